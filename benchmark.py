@@ -0,0 +1,280 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+import multiprocessing
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from PIL import Image
+from matplotlib import pyplot as plt
+import scipy.spatial    #   imported lazily by Paint, loaded up front so calcDays times the query rather than the import
+
+import hike_data_processor
+import elevation
+import tiles
+from hike_data_GUI import Paint
+from strokes import StrokeStore
+from synthetic import syntheticAltitude, writeRoute
+
+SIZES=(1000,10000,100000,1000000)
+FORMATS=('gpx','kml','kmz')
+ZOOM=12
+SMOOTH_WINDOW=100   #   m, for calcSlope_window & calcSpeed_window
+CORRIDOR=100    #   m, map corridor for getMap_corridor
+CORRIDOR_ZOOM=15    #   detailed enough that the corridor leaves out tiles, & none of them are cached
+STROKES=200 #   painted strokes for calcDays
+STROKE_POINTS=20    #   mouse events per stroke
+CANVAS=(700,300)
+TILE_VARIANTS=16    #   distinct textured tiles served by the stand-in tile server
+IMPORT_MODULES=('route_engine','hike_data_processor','hike_batch','hike_data_GUI')
+HEAVY_MODULES=('pandas','matplotlib','PIL','requests','tqdm','scipy','tkinter')
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers opentopodata (/elevation?locations=lat,lon|...) & slippy map tile (/tiles/z/x/y.png) requests with deterministic data after a fixed latency."""
+    latency=0.0
+    tiles=[]
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url=urlparse(self.path)
+        if url.path=='/elevation':
+            pairs=[pair.split(',') for pair in parse_qs(url.query)['locations'][0].split('|')]
+            coords=np.array(pairs,dtype=float)
+            alts=syntheticAltitude(coords[:,0],coords[:,1])
+            body=json.dumps({'status':'OK','results':[{'elevation':float(alt)} for alt in alts]}).encode()
+            contentType='application/json'
+        elif url.path.startswith('/tiles/'):
+            z,x,y=(int(part) for part in url.path[len('/tiles/'):-len('.png')].split('/'))
+            body=self.tiles[hash((z,x,y))%len(self.tiles)]
+            contentType='image/png'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type',contentType)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,*args):
+        pass
+
+def textureTile(seed):
+    """Noisy 256x256 png, so decoding costs about as much as a real map tile."""
+    rng=np.random.default_rng(seed)
+    pixels=(rng.integers(0,64,(256,256,3))+rng.integers(0,192,3)).astype(np.uint8)
+    data=io.BytesIO()
+    Image.fromarray(pixels).save(data,format='PNG')
+
+    return data.getvalue()
+
+def serve(latency,ready):
+    StandInHandler.latency=latency
+    StandInHandler.tiles=[textureTile(seed) for seed in range(TILE_VARIANTS)]
+    server=ThreadingHTTPServer(('127.0.0.1',0),StandInHandler)
+    server.daemon_threads=True
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+class StandInServer():
+    """Local elevation & tile server in its own process, so it doesn't compete with the code being measured for the GIL."""
+
+    def __init__(self,latency=0.0):
+        ready=multiprocessing.Queue()
+        self.process=multiprocessing.Process(target=serve,args=(latency,ready),daemon=True)
+        self.process.start()
+        self.url=f'http://127.0.0.1:{ready.get(timeout=30)}'
+
+    def close(self):
+        self.process.terminate()
+        self.process.join()
+
+def syntheticStrokes(paint,strokes,days):
+    """Random walk strokes across the canvas, as Paint.paint records them."""
+    rng=np.random.default_rng(1)
+    store=StrokeStore()
+    for i in range(strokes):
+        points=rng.uniform((0,0),CANVAS)+np.cumsum(rng.normal(0,5,(STROKE_POINTS,2)),axis=0)
+        store.begin(i*days//strokes,Paint.DEFAULT_PEN_SIZE*2/paint.canvasScale()[0])
+        for x,y in points:
+            store.add(*paint.canvasToMap(x,y))
+
+    return store
+
+def measure(results,n,stage,function,memory=True,**extra):
+    """Runs one stage, appends its wall time, peak traced memory & throughput to results. Returns the stage's result."""
+    if memory:
+        tracemalloc.reset_peak()
+        before=tracemalloc.get_traced_memory()[0]
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):   #   Path reports progress on stdout & tqdm bars on stderr
+        t0=time.perf_counter()
+        value=function()
+        seconds=time.perf_counter()-t0
+    result={'points':n,'stage':stage,'seconds':seconds,'points_per_second':n/seconds if seconds>0 else None}
+    if memory:
+        result['peak_mb']=(tracemalloc.get_traced_memory()[1]-before)/2**20
+    result.update(extra)
+    results.append(result)
+
+    return value
+
+def benchmarkSize(n,server,workdir,speed_file,memory=True):
+    """Every stage of the Path pipeline & Paint.calcDays for a route of n points, with cold caches. Returns the stage results."""
+    results=[]
+    cache_dir=tempfile.mkdtemp(dir=workdir)
+    provider=elevation.ElevationFetcher(url=server.url+'/elevation',rate=1e6)    #   no throttle, the stand-in server isn't rate limited
+    elevation_cache=elevation.ElevationCache(os.path.join(cache_dir,'elevation.sqlite'))
+    tile_cache=tiles.TileCache(os.path.join(cache_dir,'tiles.sqlite'))
+    tile_fetcher=tiles.TileFetcher()
+
+    path=None
+    for fmt in FORMATS:
+        gps_file=writeRoute(workdir,n,fmt)
+        parsed=measure(results,n,'input_'+fmt,lambda: hike_data_processor.Path(gps_file,speed_file,
+                                                                                elevation_cache=elevation_cache,
+                                                                                elevation_provider=provider,
+                                                                                tile_cache=tile_cache,
+                                                                                tile_fetcher=tile_fetcher),
+                        memory,file_mb=os.path.getsize(gps_file)/2**20)
+        if path==None:
+            path=parsed
+    path.tileServers=(server.url+'/tiles',)
+
+    measure(results,n,'calcDist',path.calcDist,memory)
+    requests_before=provider.stats['requests']
+    measure(results,n,'getElevations',path.getElevations,memory)
+    results[-1]['requests']=provider.stats['requests']-requests_before
+    measure(results,n,'getElevations_cached',path.getElevations,memory)
+    measure(results,n,'calcSlope',path.calcSlope,memory)
+    measure(results,n,'calcSpeed',path.calcSpeed,memory)
+    measure(results,n,'calcTime',path.calcTime,memory)
+    measure(results,n,'buildIndex',path.buildIndex,memory)
+    path.smoothWindow=SMOOTH_WINDOW
+    measure(results,n,'calcSlope_window',path.calcSlope,memory)
+    measure(results,n,'calcSpeed_window',path.calcSpeed,memory)
+    path.smoothWindow=None  #   back to the per-point model for the later stages
+    path.calcSlope()
+    path.calcSpeed()
+    path.analysed=True
+
+    requests_before=tile_fetcher.stats['requests']
+    measure(results,n,'getMap',lambda: path.getMap(0,ZOOM),memory)
+    results[-1]['tiles']=tile_fetcher.stats['requests']-requests_before
+    measure(results,n,'getMap_cached',lambda: path.getMap(0,ZOOM),memory)
+    path.mapCorridor=CORRIDOR
+    requests_before=tile_fetcher.stats['requests']
+    img,geometry=measure(results,n,'getMap_corridor',lambda: path.buildMap(0,CORRIDOR_ZOOM,verbose=False),memory)
+    results[-1]['tiles']=tile_fetcher.stats['requests']-requests_before
+    results[-1]['tiles_skipped']=geometry['tiles_skipped']
+    path.mapCorridor=None
+
+    fig=measure(results,n,'plotElevation',path.plotElevation,memory)
+    plt.close(fig)
+
+    paint=Paint.__new__(Paint)  #   just the state calcDays needs, no Tk window
+    paint.path=path
+    paint.width,paint.height=CANVAS
+    paint.trace_cache={}
+    paint.route_lat=path.hikeData['lat'].to_numpy()
+    paint.route_lon=path.hikeData['lon'].to_numpy()
+    paint.strokes=syntheticStrokes(paint,STROKES,days=3)
+    paint.autoDays=None
+    measure(results,n,'mapCoord_to_canvasCoord',paint.mapCoord_to_canvasCoord,memory)
+    measure(results,n,'calcDays',paint.calcDays,memory,strokes=STROKES)
+    measure(results,n,'splitDays',lambda: path.splitDays(target_hours=8,rest_km=10,rest_lunch=60),memory)
+    measure(results,n,'calcDayData',path.calcDayData,memory)
+
+    elevation_cache.db.close()
+    tile_cache.close()
+
+    return results
+
+def importTime(module,repeat=5):
+    """Cold import time of a module in a fresh interpreter, fastest of repeat. Returns (seconds, heavy modules it pulls in)."""
+    code=f"import sys,time,json;t=time.perf_counter();import {module};print(json.dumps([time.perf_counter()-t,[m for m in {HEAVY_MODULES!r} if m in sys.modules]]))"
+    runs=[json.loads(subprocess.run([sys.executable,'-c',code],cwd=os.path.dirname(os.path.abspath(__file__)),capture_output=True,text=True,check=True).stdout) for _ in range(repeat)]
+
+    return min(run[0] for run in runs),runs[0][1]
+
+def commit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def compare(report,baseline,threshold):
+    """Prints stages that got slower than baseline by more than threshold (fraction). Returns the number of regressions."""
+    old={(result['points'],result['stage']):result['seconds'] for result in baseline['results']}
+    regressions=0
+    for result in report['results']:
+        key=(result['points'],result['stage'])
+        if key not in old or old[key]<=0:
+            continue
+        ratio=result['seconds']/old[key]
+        if ratio>1+threshold:
+            regressions+=1
+            print(f"REGRESSION {result['stage']} ({result['points']} points): {old[key]:.4f} s -> {result['seconds']:.4f} s ({ratio:.2f}x)")
+
+    return regressions
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Times each stage of the Path pipeline on synthetic routes against local stand-in elevation & tile servers.')
+    parser.add_argument('--sizes',type=int,nargs='*',default=SIZES,help='Route sizes (points). None only times imports.')
+    parser.add_argument('--speed-data',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'hike.json'),help='Speed (kph) against gradient data (.json)')
+    parser.add_argument('--latency',type=float,default=20,help='Stand-in server latency per request (ms).')
+    parser.add_argument('--repeat',type=int,default=1,help='Runs per size. The fastest run of each stage is reported.')
+    parser.add_argument('--no-memory',action='store_true',help="Don't trace peak memory (tracemalloc slows python heavy stages down).")
+    parser.add_argument('--workdir',help='Directory for the synthetic routes & caches. Routes are reused between runs. Defaults to a temporary directory.')
+    parser.add_argument('-o','--output',help='Write the report to this json file.')
+    parser.add_argument('--compare',help='Baseline report (json) to compare stage times against.')
+    parser.add_argument('--threshold',type=float,default=0.2,help='Slowdown (fraction) over the baseline reported as a regression.')
+    args=parser.parse_args()
+
+    workdir=args.workdir or tempfile.mkdtemp(prefix='hike_benchmark_')
+    os.makedirs(workdir,exist_ok=True)
+    memory=not args.no_memory
+    if memory:
+        tracemalloc.start()
+
+    results=[]
+    for module in IMPORT_MODULES:
+        seconds,loaded=importTime(module)
+        results.append({'points':0,'stage':'import_'+module,'seconds':seconds,'modules':loaded})
+        print(f"{0:>9} {'import_'+module:<28} {seconds:>9.4f} s {' '.join(loaded)}")
+
+    server=StandInServer(args.latency/1000)
+    try:
+        for n in args.sizes:
+            runs=[benchmarkSize(n,server,workdir,args.speed_data,memory) for _ in range(args.repeat)]
+            for stage in zip(*runs):
+                best=min(stage,key=lambda result: result['seconds'])
+                results.append(best)
+                print(f"{n:>9} {best['stage']:<28} {best['seconds']:>9.4f} s"+(f" {best['peak_mb']:>9.1f} MB" if memory else ''))
+    finally:
+        server.close()
+
+    report={
+        'commit':commit(),
+        'python':platform.python_version(),
+        'platform':platform.platform(),
+        'cpus':os.cpu_count(),
+        'settings':{'latency_ms':args.latency,'repeat':args.repeat,'memory':memory,'zoom':ZOOM,'smooth_window':SMOOTH_WINDOW,'corridor':CORRIDOR,'corridor_zoom':CORRIDOR_ZOOM,'strokes':STROKES,'stroke_points':STROKE_POINTS},
+        'results':results,
+    }
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(report,f,indent=4)
+
+    if args.compare:
+        with open(args.compare,'r') as f:
+            regressions=compare(report,json.load(f),args.threshold)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from argparse import ArgumentParser
+import numpy as np
+
+import gps_import
+import route_engine
+
+WINDOW=50   #   m, recordings are resampled to windows this long, which evens out gps & altitude noise
+BIN_WIDTH=2 #   slope units (as route_engine.slope)
+MAX_SLOPE=40
+MIN_BIN_KM=1    #   bins with less distance than this are left out of the curve
+MIN_SPEED=1 #   kph, slower windows are stops
+MAX_SPEED=10    #   kph, faster windows are gps jumps or transport
+CHUNKSIZE=8 #   files per task sent to a worker
+
+class Calibration():
+    """Sums over recorded windows that are enough to fit the speed model: distance & time per slope bin, and the weighted least squares normal equations
+    of speed = neutral + pos*max(slope,0) + neg*min(slope,0) (weighted by distance). Sums of several files add up, so memory doesn't grow with the corpus."""
+
+    def __init__(self,edges):
+        self.edges=edges
+        self.dist=np.zeros(len(edges)-1)    #   km
+        self.time=np.zeros(len(edges)-1)    #   hrs
+        self.xtx=np.zeros((3,3))
+        self.xty=np.zeros(3)
+        self.files=0
+        self.skipped=0
+        self.windows=0
+
+    def add(self,dist,time,slope):
+        """Adds windows: distance (km), time (hrs) & slope of each."""
+        speed=dist/time
+        b=np.clip(np.searchsorted(self.edges,slope,side='right')-1,0,len(self.dist)-1)
+        self.dist+=np.bincount(b,weights=dist,minlength=len(self.dist))
+        self.time+=np.bincount(b,weights=time,minlength=len(self.time))
+
+        x=np.column_stack((np.ones(len(slope)),np.maximum(slope,0),np.minimum(slope,0)))
+        self.xtx+=x.T@(x*dist[:,None])
+        self.xty+=x.T@(speed*dist)
+        self.windows+=len(dist)
+
+    def merge(self,other):
+        self.dist+=other.dist
+        self.time+=other.time
+        self.xtx+=other.xtx
+        self.xty+=other.xty
+        self.files+=other.files
+        self.skipped+=other.skipped
+        self.windows+=other.windows
+
+    def fit(self):
+        """Returns (neutral, pos, neg) of the piecewise linear speed model."""
+        neutral,pos,neg=np.linalg.lstsq(self.xtx,self.xty,rcond=None)[0]
+
+        return float(neutral),float(pos),float(neg)
+
+    def curve(self,min_bin_km=MIN_BIN_KM):
+        """Distance weighted mean speed of each slope bin with enough data. Returns (bin centres, speeds)."""
+        centres=(self.edges[:-1]+self.edges[1:])/2
+        enough=(self.dist>=min_bin_km)&(self.time>0)
+
+        return centres[enough],self.dist[enough]/self.time[enough]
+
+def windows(lat,lon,alt,hours,window):
+    """Resamples one track segment to windows of equal distance. Returns distance (km), time (hrs) & slope of each window."""
+    dist=route_engine.haversine(np.radians(lat),np.radians(lon))
+    distSum=route_engine.cumulative(dist)
+    if len(distSum)<2 or distSum[-1]<window:
+        return np.zeros(0),np.zeros(0),np.zeros(0)
+
+    marks=np.arange(0,distSum[-1],window)
+    t=np.interp(marks,distSum,hours)
+    a=np.interp(marks,distSum,alt)
+    d=np.full(len(marks),window)
+    d[0]=0
+
+    return d[1:],np.diff(t),route_engine.slope(a,d)[1:]
+
+def readRecording(file,edges,window,min_speed,max_speed):
+    """Sums the windows of every track segment of one timestamped recording with elevations. Runs on the worker processes."""
+    calibration=Calibration(edges)
+    try:
+        _,columns=gps_import.read(file)
+    except Exception:   #   an unreadable recording is skipped, not fatal
+        calibration.skipped+=1
+        return calibration
+    if 'timestamp' not in columns or 'ele' not in columns:
+        calibration.skipped+=1
+        return calibration
+
+    valid=~np.isnat(columns['timestamp'])&~np.isnan(columns['ele'])
+    hours=columns['timestamp'].astype(np.int64)/3.6e6
+    segment=columns['segment']
+    bounds=np.concatenate(([0],np.flatnonzero(np.diff(segment)!=0)+1,[len(segment)]))
+    for start,end in zip(bounds[:-1],bounds[1:]):
+        keep=np.flatnonzero(valid[start:end])+start
+        dist,time,slope=windows(columns['lat'][keep],columns['lon'][keep],columns['ele'][keep],hours[keep],window/1000)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            speed=dist/time
+        moving=(time>0)&(speed>=min_speed)&(speed<=max_speed)
+        calibration.add(dist[moving],time[moving],slope[moving])
+    calibration.files+=1
+
+    return calibration
+
+def calibrate(files,edges,window=WINDOW,min_speed=MIN_SPEED,max_speed=MAX_SPEED,workers=None):
+    """Streams recordings through a process pool. Only the per-file sums come back, so memory is bounded whatever the number of files."""
+    total=Calibration(edges)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        n=len(files)
+        results=pool.map(readRecording,files,[edges]*n,[window]*n,[min_speed]*n,[max_speed]*n,chunksize=CHUNKSIZE)
+        for i,calibration in enumerate(results):
+            total.merge(calibration)
+            if (i+1)%100==0:
+                print(f"{i+1}/{n} files")
+
+    return total
+
+def speedData(calibration,model,min_bin_km=MIN_BIN_KM,window=WINDOW):
+    """Speed json for Path.calcSpeed. The linear model is always included; the binned curve, if chosen, is used in its place.
+    window (m) is stored so routes are smoothed over the same distance the slopes were fitted on."""
+    neutral,pos,neg=calibration.fit()
+    data={'pos':pos,'neg':neg,'neutral':neutral,'window':window}
+    if model=='binned':
+        slope,speed=calibration.curve(min_bin_km)
+        if len(slope)!=0:
+            data['curve']={'slope':slope.tolist(),'speed':speed.tolist()}
+    data['calibration']={'files':calibration.files,'km':float(calibration.dist.sum()),'hrs':float(calibration.time.sum()),'windows':calibration.windows}
+
+    return data
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Fits a speed (kph) against gradient model to timestamped gpx recordings.')
+    parser.add_argument('recordings',nargs='+',help='Recorded tracks with times & elevations (gpx, kml, kmz), directories or glob patterns.')
+    parser.add_argument('-o','--output',default='speed.json',help='Speed data (.json) for hike_data_GUI.py & hike_batch.py.')
+    parser.add_argument('--model',choices=('linear','binned'),default='binned',help='binned also writes the mean speed of each slope bin, used instead of the linear fit.')
+    parser.add_argument('-j','--workers',type=int,default=os.cpu_count(),help='Number of processes.')
+    parser.add_argument('--window',type=float,default=WINDOW,help='Resampling window (m).')
+    parser.add_argument('--bin-width',type=float,default=BIN_WIDTH,help='Slope bin width (slope units as route_engine.slope).')
+    parser.add_argument('--max-slope',type=float,default=MAX_SLOPE,help='Bins cover -max to +max slope; steeper windows go in the end bins.')
+    parser.add_argument('--min-bin-km',type=float,default=MIN_BIN_KM,help='Min. recorded distance (km) for a bin to be in the curve.')
+    parser.add_argument('--min-speed',type=float,default=MIN_SPEED,help='Slower windows are treated as stops (kph).')
+    parser.add_argument('--max-speed',type=float,default=MAX_SPEED,help='Faster windows are treated as gps errors (kph). Raise for cycling.')
+    args=parser.parse_args()
+
+    files=gps_import.find(args.recordings)
+    edges=np.arange(-args.max_slope,args.max_slope+args.bin_width/2,args.bin_width)
+    print(f"Calibrating on {len(files)} recordings...")
+    t0=time.perf_counter()
+    calibration=calibrate(files,edges,args.window,args.min_speed,args.max_speed,args.workers)
+    if calibration.windows==0:
+        raise SystemExit("No timestamped recordings with elevations found.")
+
+    data=speedData(calibration,args.model,args.min_bin_km,args.window)
+    with open(args.output,'w') as f:
+        json.dump(data,f,indent=4)
+
+    print(f"{calibration.files} recordings ({calibration.skipped} skipped: no times or elevations), {data['calibration']['km']:.0f} km in {time.perf_counter()-t0:.1f} s")
+    print(f"pos: {data['pos']:.4f}, neg: {data['neg']:.4f}, neutral: {data['neutral']:.2f} kph")
+    if 'curve' in data:
+        for slope,speed in zip(data['curve']['slope'],data['curve']['speed']):
+            print(f"{slope:>6.1f} {speed:>6.2f} kph")
+    print(f"Written to {args.output}")
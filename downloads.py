@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+import instrument
+
+#   requests is imported where it is first used, so modules that only might download start without it
+
+USER_AGENT='hike-planner/1.0 (hiking route planner; python-requests)'   #   tile servers refuse requests without an identifying one
+CONTACT_ENV='HIKE_PLANNER_CONTACT'  #   e.g. an email address, added to the user agent as the osm tile usage policy asks
+
+hostSlots={}    #   host: semaphore bounding the requests in flight to it from this process
+hostSlotsLock=threading.Lock()
+
+def userAgent():
+    contact=os.environ.get(CONTACT_ENV)
+    return USER_AGENT if not contact else f'{USER_AGENT[:-1]}; {contact})'
+
+def hostSlot(url,connections):
+    """Semaphore shared by every fetcher in the process for url's host. The first caller sets its size."""
+    host=urlparse(url).netloc
+    with hostSlotsLock:
+        if host not in hostSlots:
+            hostSlots[host]=threading.BoundedSemaphore(connections)
+        return hostSlots[host]
+
+class HttpFetcher():
+    """Pooled, identified http session with retries, exponential backoff & a cap on concurrent requests per host, shared by ElevationFetcher & TileFetcher.
+    Subclasses set COUNTER (prefix of their instrument counters) & a stats dict with 'requests' & 'retries'."""
+    COUNTER=None
+
+    def __init__(self,workers,retries,timeout,backoff,host_connections,limiter=None):
+        self.workers=workers
+        self.retries=retries
+        self.timeout=timeout
+        self.backoff=backoff
+        self.host_connections=host_connections
+        self.limiter=limiter    #   TokenBucket, if the server has a rate limit
+
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session=requests.Session()
+        self.session.headers['User-Agent']=userAgent()
+        adapter=HTTPAdapter(pool_connections=4,pool_maxsize=workers)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+
+        self.stats_lock=threading.Lock()
+
+    def get(self,url,params=None):
+        """GETs url, retrying timeouts, server errors & rate limiting. Returns the response; raises the last error once retries run out."""
+        import requests
+
+        for attempt in range(self.retries+1):
+            if self.limiter!=None:
+                self.limiter.acquire()
+            with self.stats_lock:
+                self.stats['requests']+=1
+            instrument.count(f'{self.COUNTER}.requests')
+            try:
+                with hostSlot(url,self.host_connections):
+                    response=self.session.get(url,params=params,timeout=self.timeout)
+            except (requests.Timeout,requests.ConnectionError):
+                if attempt==self.retries:
+                    raise
+            else:
+                if response.status_code<500 and response.status_code!=429:   #   only server errors & rate limiting are retried
+                    response.raise_for_status()
+                    instrument.count(f'{self.COUNTER}.bytes',len(response.content))
+                    return response
+                if attempt==self.retries:
+                    response.raise_for_status()
+
+            with self.stats_lock:
+                self.stats['retries']+=1
+            instrument.count(f'{self.COUNTER}.retries')
+            time.sleep(self.backoff*2**attempt)
+
+    def pipeline(self,function,tasks,landed):
+        """Runs function(*task) for every task on the workers. landed(task,result) is called on this thread as each finishes.
+        At most 2 tasks are queued per worker, so a long task list isn't submitted all at once."""
+        tasks=iter(tasks)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending={}
+            while True:
+                for task in tasks:
+                    pending[pool.submit(function,*task)]=task
+                    if len(pending)>=2*self.workers:
+                        break
+                if len(pending)==0:
+                    break
+
+                done,_=wait(pending,return_when=FIRST_COMPLETED)
+                for future in done:
+                    landed(pending.pop(future),future.result())
@@ -0,0 +1,313 @@
+import os.path
+import abc
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+
+import instrument
+import downloads
+
+DEFAULT_CACHE_DIR=os.path.join(os.path.expanduser('~'),'.hike_planner')
+
+class ElevationCache():
+    """Persistent store of altitudes keyed by lat/lon quantized to ~1 m, so every point keeps its own (interpolated) altitude rather than that of its DEM cell."""
+    GRID=1/111320   #   1 m in degrees of latitude
+    VERSION=2   #   sqlite user_version; caches keyed by an older grid are emptied
+    DEFAULT_MAX_ENTRIES=2000000 #   ~60 MB on disk
+
+    def __init__(self,file=None,max_entries=None):
+        if file==None:
+            file=os.path.join(DEFAULT_CACHE_DIR,'elevation.sqlite')
+        if os.path.dirname(file)!='':
+            os.makedirs(os.path.dirname(file),exist_ok=True)
+        self.file=file
+        self.max_entries=self.DEFAULT_MAX_ENTRIES if max_entries==None else max_entries
+
+        self.lock=threading.Lock()
+        self.db=sqlite3.connect(file,timeout=30,check_same_thread=False)
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")  #   lets several processes read while one writes
+            if self.db.execute("PRAGMA user_version").fetchone()[0]<self.VERSION:  #   its keys mean other places
+                self.db.execute("DROP TABLE IF EXISTS elevation")
+                self.db.execute("DROP TABLE IF EXISTS elevation_count")
+                self.db.execute(f"PRAGMA user_version={self.VERSION}")
+            self.db.execute("CREATE TABLE IF NOT EXISTS elevation (key INTEGER PRIMARY KEY, alt REAL, used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS elevation_used ON elevation (used)")
+            #   row count, updated by put() & evict() in the same transaction as the rows, so every process sharing the cache enforces the real total without counting
+            self.db.execute("CREATE TABLE IF NOT EXISTS elevation_count (id INTEGER PRIMARY KEY, entries INTEGER)")
+            self.db.execute("INSERT OR IGNORE INTO elevation_count SELECT 0,COUNT(*) FROM elevation")
+
+    def keys(self,coords):
+        """Quantizes [lat,lon] pairs to a single integer key per grid cell."""
+        coords=np.asarray(coords,dtype=float).reshape(-1,2)
+        lat_q=np.round(coords[:,0]/self.GRID).astype(np.int64)+(1<<24)   #   offsets keep both parts positive
+        lon_q=np.round(coords[:,1]/self.GRID).astype(np.int64)+(1<<25)
+
+        return (lat_q<<26)|lon_q
+
+    def get(self,keys):
+        """Looks up keys. Returns altitudes (nan where unknown) & mask of keys found in the cache."""
+        keys=np.asarray(keys,dtype=np.int64)
+        alts=np.full(len(keys),np.nan)
+        found=np.zeros(len(keys),dtype=bool)
+        if len(keys)==0:
+            return alts,found
+
+        unique,inverse=np.unique(keys,return_inverse=True)
+        with self.lock, self.db:
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS query (key INTEGER PRIMARY KEY)")
+            self.db.execute("DELETE FROM query")
+            self.db.executemany("INSERT INTO query VALUES (?)",((int(k),) for k in unique))
+            rows=self.db.execute("SELECT key,alt FROM elevation JOIN query USING (key)").fetchall()
+            self.db.execute("UPDATE elevation SET used=? WHERE key IN (SELECT key FROM query)",(time.time(),))
+
+        if len(rows)!=0:
+            hit_keys=np.array([row[0] for row in rows],dtype=np.int64)
+            hit_alts=np.array([np.nan if row[1]==None else row[1] for row in rows],dtype=float)    #   NULL = no data at this point
+            order=np.argsort(hit_keys)
+            hit_keys,hit_alts=hit_keys[order],hit_alts[order]
+
+            pos=np.searchsorted(hit_keys,unique)
+            pos[pos==len(hit_keys)]=0
+            hit=hit_keys[pos]==unique
+            found=hit[inverse]
+            alts[found]=hit_alts[pos][inverse][found]
+
+        hits=int(np.count_nonzero(found))
+        instrument.count('elevation_cache.hits',hits)
+        instrument.count('elevation_cache.misses',len(keys)-hits)
+
+        return alts,found
+
+    def put(self,keys,alts):
+        """Stores altitudes (nan stored as no data) & evicts least recently used entries over the size limit."""
+        now=time.time()
+        rows=[(int(k),None if np.isnan(a) else float(a),now) for k,a in zip(keys,alts)]
+        with self.lock, self.db:
+            inserted=self.db.executemany("INSERT OR IGNORE INTO elevation VALUES (?,?,?)",rows).rowcount
+            if inserted<len(rows):  #   some keys were already stored
+                self.db.executemany("UPDATE elevation SET alt=?,used=? WHERE key=?",((alt,used,key) for key,alt,used in rows))
+            self.db.execute("UPDATE elevation_count SET entries=entries+? WHERE id=0",(inserted,))
+            self.evict()
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits max_entries. Caller holds the lock & a transaction."""
+        count=self.db.execute("SELECT entries FROM elevation_count WHERE id=0").fetchone()[0]
+        if count>self.max_entries:
+            deleted=self.db.execute("DELETE FROM elevation WHERE key IN (SELECT key FROM elevation ORDER BY used LIMIT ?)",(count-self.max_entries,)).rowcount
+            self.db.execute("UPDATE elevation_count SET entries=entries-? WHERE id=0",(deleted,))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM elevation").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class TokenBucket():
+    """Thread-safe token bucket. acquire() blocks until a call is allowed."""
+
+    def __init__(self,rate,capacity=1):
+        self.rate=rate  #   tokens per second
+        self.capacity=capacity
+        self.tokens=capacity
+        self.last=time.monotonic()
+        self.lock=threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now=time.monotonic()
+            self.tokens=min(self.capacity,self.tokens+(now-self.last)*self.rate)
+            self.last=now
+            wait_time=(1-self.tokens)/self.rate if self.tokens<1 else 0
+            self.tokens-=1  #   may go negative - later callers queue up behind this one
+        if wait_time>0:
+            time.sleep(wait_time)
+
+class ElevationProvider(abc.ABC):
+    """Source of altitudes. Subclasses implement fetch."""
+    cached=True #   whether results should be stored in the ElevationCache
+
+    def __init__(self):
+        self.stats={'requests':0,'retries':0,'points':0,'seconds':0.0,'requests_per_second':0.0}
+
+    def source(self):
+        """Identifies where the altitudes come from, so results from another source aren't reused (see Path.sourceChecksums)."""
+        return type(self).__name__
+
+    @abc.abstractmethod
+    def fetch(self,coords,callback=None):
+        """Altitudes of [lat,lon] coords (nan where there is no data) in input order. callback(start,alts) is called as each chunk is known."""
+
+class ElevationFetcher(ElevationProvider,downloads.HttpFetcher):
+    """Downloads altitudes from an opentopodata style api over a pooled session, with a bounded number of requests in flight."""
+    URL='https://api.opentopodata.org/v1/eudem25m'
+    CHUNK=100   #   100 locations per call max
+    RATE=3  #   3 calls per second max
+    WORKERS=4
+    RETRIES=4
+    TIMEOUT=10  #   seconds
+    BACKOFF=0.5 #   seconds, doubled every retry
+    COUNTER='elevation'
+
+    def __init__(self,url=URL,rate=RATE,workers=WORKERS,retries=RETRIES,timeout=TIMEOUT,backoff=BACKOFF):
+        self.url=url
+        ElevationProvider.__init__(self)
+        downloads.HttpFetcher.__init__(self,workers,retries,timeout,backoff,host_connections=workers,limiter=TokenBucket(rate))
+
+    def request(self,chunk):
+        """Gets one chunk of altitudes. Returns nan where there is no data."""
+        params={'locations':"|".join(",".join(str(n) for n in pair) for pair in chunk)}
+        results=self.get(self.url,params=params).json()['results']
+
+        return np.array([np.nan if result['elevation']==None else float(result['elevation']) for result in results])
+
+    def source(self):
+        return self.url
+
+    def fetch(self,coords,callback=None):
+        """Gets altitudes for [lat,lon] pairs. callback(start,alts) is called as each chunk lands. Results are in input order."""
+        coords=np.asarray(coords,dtype=float).reshape(-1,2)
+        elevations=np.full(len(coords),np.nan)
+
+        def landed(task,alts):
+            start=task[0]
+            elevations[start:start+len(alts)]=alts
+            if callback!=None:
+                callback(start,alts)
+
+        t0=time.perf_counter()
+        requests_before=self.stats['requests']
+        self.pipeline(lambda start: self.request(coords[start:start+self.CHUNK]),((start,) for start in range(0,len(coords),self.CHUNK)),landed)
+
+        seconds=time.perf_counter()-t0
+        with self.stats_lock:
+            self.stats['points']+=len(coords)
+            self.stats['seconds']+=seconds
+            if seconds>0:
+                self.stats['requests_per_second']=(self.stats['requests']-requests_before)/seconds
+
+        return elevations
+
+class DEMTile():
+    """Regular lat/lon grid of altitudes. top/left are the coordinates of the centre of pixel [0,0]."""
+
+    def __init__(self,data,top,left,dlat,dlon,nodata=None):
+        self.data=data  #   2D, rows go south, may be a memmap
+        self.top=top
+        self.left=left
+        self.dlat=dlat  #   degrees per pixel, positive
+        self.dlon=dlon
+        self.nodata=nodata
+
+        self.bot=top-(data.shape[0]-1)*dlat
+        self.right=left+(data.shape[1]-1)*dlon
+
+    def contains(self,lat,lon):
+        return (lat<=self.top)&(lat>=self.bot)&(lon>=self.left)&(lon<=self.right)
+
+    def sample(self,lat,lon):
+        """Bilinear interpolation of points inside the tile. Only the pixels around each point are read from disk."""
+        row=(self.top-lat)/self.dlat
+        col=(lon-self.left)/self.dlon
+        r0=np.clip(np.floor(row).astype(np.intp),0,max(self.data.shape[0]-2,0))
+        c0=np.clip(np.floor(col).astype(np.intp),0,max(self.data.shape[1]-2,0))
+        r1=np.minimum(r0+1,self.data.shape[0]-1)
+        c1=np.minimum(c0+1,self.data.shape[1]-1)
+        fr=row-r0
+        fc=col-c0
+
+        corners=[np.asarray(self.data[r,c],dtype=float) for r,c in ((r0,c0),(r0,c1),(r1,c0),(r1,c1))]
+        if self.nodata!=None:
+            for corner in corners:
+                corner[corner==self.nodata]=np.nan
+        z00,z01,z10,z11=corners
+
+        return (z00*(1-fc)+z01*fc)*(1-fr)+(z10*(1-fc)+z11*fc)*fr
+
+    @classmethod
+    def fromNpy(cls,file):
+        """Memory maps a .npy grid. Georeferencing is read from a json sidecar with the same name (top, left, dlat, dlon, nodata)."""
+        with open(os.path.splitext(file)[0]+'.json','r') as f:
+            meta=json.load(f)
+        data=np.load(file,mmap_mode='r')
+
+        return cls(data,meta['top'],meta['left'],meta['dlat'],meta['dlon'],meta.get('nodata'))
+
+    @classmethod
+    def fromGeoTiff(cls,file):
+        """Memory maps an uncompressed GeoTIFF (falls back to reading it into memory). Requires tifffile."""
+        try:
+            import tifffile
+        except ImportError as error:
+            raise ImportError("Reading GeoTIFF DEMs requires tifffile: pip install tifffile") from error
+
+        with tifffile.TiffFile(file) as tif:
+            page=tif.pages[0]
+            scale=page.tags['ModelPixelScaleTag'].value
+            tiepoint=page.tags['ModelTiepointTag'].value
+            nodata=page.tags['GDAL_NODATA'].value if 'GDAL_NODATA' in page.tags else None
+            if page.is_memmappable:
+                data=tif.asarray(out='memmap')
+            else:
+                data=tif.asarray()
+
+        #   tiepoint is the top left corner of pixel [0,0] - shift to its centre
+        dlon,dlat=scale[0],scale[1]
+        top=tiepoint[4]-dlat/2
+        left=tiepoint[3]+dlon/2
+        if nodata!=None:
+            nodata=float(nodata)
+
+        return cls(data,top,left,dlat,dlon,nodata)
+
+class LocalDEMProvider(ElevationProvider):
+    """Samples altitudes from local DEM rasters (.npy + .json sidecar, or GeoTIFF). Points outside every tile get nan."""
+    cached=False    #   sampling is faster than a cache lookup
+    EXTENSIONS=('.npy','.tif','.tiff')
+
+    def __init__(self,paths):
+        super().__init__()
+        if isinstance(paths,str):
+            paths=[paths]
+
+        files=[]
+        for path in paths:
+            if os.path.isdir(path):
+                files+=[os.path.join(path,file) for file in sorted(os.listdir(path)) if os.path.splitext(file)[1].lower() in self.EXTENSIONS]
+            else:
+                files.append(path)
+
+        self.files=files
+        self.tiles=[]
+        for file in files:
+            if os.path.splitext(file)[1].lower()=='.npy':
+                self.tiles.append(DEMTile.fromNpy(file))
+            else:
+                self.tiles.append(DEMTile.fromGeoTiff(file))
+
+    def source(self):
+        """The rasters, by path, size & modification time rather than a checksum of what can be gigabytes."""
+        return [[os.path.abspath(file),os.path.getsize(file),os.path.getmtime(file)] for file in self.files]
+
+    def fetch(self,coords,callback=None):
+        coords=np.asarray(coords,dtype=float).reshape(-1,2)
+        lat,lon=coords[:,0],coords[:,1]
+        elevations=np.full(len(coords),np.nan)
+
+        t0=time.perf_counter()
+        for tile in self.tiles:
+            inside=np.flatnonzero(tile.contains(lat,lon)&np.isnan(elevations))  #   first tile wins where tiles overlap
+            if len(inside)!=0:
+                elevations[inside]=tile.sample(lat[inside],lon[inside])
+
+        self.stats['points']+=len(coords)
+        self.stats['seconds']+=time.perf_counter()-t0
+        instrument.count('dem.points',len(coords))
+        if callback!=None:
+            callback(0,elevations)
+
+        return elevations
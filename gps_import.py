@@ -0,0 +1,270 @@
+import os
+import re
+import glob
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+
+EXTENSIONS=('.gpx','.kml','.kmz')
+TRACK_CHUNK=4096    #   gx:Track points parsed & added to the track at a time
+UTC_OFFSET=re.compile(r'T.*\d(Z|([+-])(\d{2})(?::?(\d{2}))?)$')   #   timezone designator at the end of a date & time
+
+class TrackBuffer():
+    """Growable columns of track points. Capacity doubles when full, so appends are amortised O(1)."""
+
+    def __init__(self,capacity=4096):
+        self.n=0
+        self.segments=0
+        self.lat=np.empty(capacity)
+        self.lon=np.empty(capacity)
+        self.ele=np.empty(capacity)
+        self.time=np.empty(capacity,dtype='datetime64[ms]')
+        self.segment=np.empty(capacity,dtype=np.int32)
+
+    def reserve(self,extra):
+        needed=self.n+extra
+        if needed<=len(self.lat):
+            return
+
+        capacity=max(needed,2*len(self.lat))
+        for column in ('lat','lon','ele','time','segment'):
+            old=getattr(self,column)
+            new=np.empty(capacity,dtype=old.dtype)
+            new[:self.n]=old[:self.n]
+            setattr(self,column,new)
+
+    def newSegment(self):
+        """Points added after this belong to a new segment."""
+        self.segments+=1
+
+    def append(self,lat,lon,ele=np.nan,time=None):
+        self.reserve(1)
+        i=self.n
+        self.lat[i]=lat
+        self.lon[i]=lon
+        self.ele[i]=ele
+        self.time[i]=parseTime(time)
+        self.segment[i]=self.segments-1
+        self.n+=1
+
+    def extend(self,lat,lon,ele=None,time=None):
+        """Appends arrays of points to the current segment."""
+        count=len(lat)
+        self.reserve(count)
+        rows=slice(self.n,self.n+count)
+        self.lat[rows]=lat
+        self.lon[rows]=lon
+        self.ele[rows]=np.nan if ele is None else ele
+        self.time[rows]=np.datetime64('NaT') if time is None else time
+        self.segment[rows]=self.segments-1
+        self.n+=count
+
+    def columns(self):
+        """Trimmed columns. ele & timestamp are only included if the file had them."""
+        segment=np.unique(self.segment[:self.n],return_inverse=True)[1].astype(np.int32)  #   empty segments don't count
+        columns={'lat':self.lat[:self.n],'lon':self.lon[:self.n],'segment':segment}
+        if not np.isnan(self.ele[:self.n]).all():
+            columns['ele']=self.ele[:self.n]
+        if not np.isnat(self.time[:self.n]).all():
+            columns['timestamp']=self.time[:self.n]
+
+        return columns
+
+def find(inputs):
+    """gps files in the given files, directories & glob patterns, sorted & without duplicates."""
+    files=set()
+    for pattern in inputs:
+        for path in glob.glob(pattern,recursive=True) or [pattern]:
+            if os.path.isdir(path):
+                for root,_,names in os.walk(path):
+                    files.update(os.path.join(root,name) for name in names if os.path.splitext(name)[1].lower() in EXTENSIONS)
+            elif os.path.splitext(path)[1].lower() in EXTENSIONS and os.path.isfile(path):
+                files.add(path)
+
+    return sorted(files)
+
+def parseTime(text):
+    """ISO 8601 timestamp to datetime64[ms] (UTC). NaT if missing or unreadable."""
+    if text==None:
+        return np.datetime64('NaT')
+    text=text.strip()
+    offset=np.timedelta64(0,'m')
+    match=UTC_OFFSET.search(text)
+    if match!=None: #   numpy only parses offsets with a deprecation warning, so they're removed & applied here
+        if match.group(1)!='Z':
+            minutes=60*int(match.group(3))+int(match.group(4) or 0)
+            offset=np.timedelta64(minutes if match.group(2)=='+' else -minutes,'m')
+        text=text[:match.start(1)]
+    try:
+        return np.datetime64(text,'ms')-offset
+    except ValueError:
+        return np.datetime64('NaT')
+
+def localName(tag):
+    return tag.rsplit('}',1)[-1]
+
+def read(file):
+    """Reads a gpx, kml or kmz file. Returns (name, columns dict of lat, lon, segment & ele/timestamp where present)."""
+    ext=os.path.splitext(file)[1].lower()
+    if ext=='.gpx':
+        return readGpx(file)
+    if ext=='.kml':
+        return readKml(file)
+    if ext=='.kmz':
+        return readKmz(file)
+
+    raise ValueError(f"Unsupported gps file type '{ext}'. Expected one of {', '.join(EXTENSIONS)}")
+
+def readKmz(file):
+    """Streams the kml out of a kmz archive without extracting it."""
+    with zipfile.ZipFile(file,'r') as archive:
+        names=archive.namelist()
+        kml='doc.kml' if 'doc.kml' in names else next(name for name in names if name.lower().endswith('.kml'))
+        with archive.open(kml,'r') as f:
+            return readKml(f)
+
+def readGpx(file):
+    """Incrementally parses every trk/trkseg of a gpx file. Each point, and every finished top level element (tracks, routes, waypoints...), is dropped from the tree once read, so memory stays bounded."""
+    track=TrackBuffer()
+    name=None
+    fallbackName=None
+    stack=[]
+
+    for event,elem in ET.iterparse(file,events=('start','end')):
+        tag=localName(elem.tag)
+        if event=='start':
+            stack.append(elem)
+            if tag=='trkseg':
+                track.newSegment()
+            continue
+
+        stack.pop()
+        parent=localName(stack[-1].tag) if len(stack)!=0 else None
+        if tag=='trkpt':
+            ele=time=None
+            for child in elem:
+                childTag=localName(child.tag)
+                if childTag=='ele':
+                    ele=child.text
+                elif childTag=='time':
+                    time=child.text
+            track.append(float(elem.attrib['lat']),float(elem.attrib['lon']),np.nan if ele==None else float(ele),time)
+        elif tag=='name':
+            if parent=='trk' and name==None:
+                name=elem.text
+            elif parent=='metadata' and fallbackName==None:
+                fallbackName=elem.text
+            continue
+        elif tag not in ('trkseg','rtept') and len(stack)!=1:  #   stack holds just the root for its children
+            continue
+
+        elem.clear()
+        if len(stack)!=0:
+            stack[-1].remove(elem)
+
+    return (name if name!=None else fallbackName),track.columns()
+
+def parseCoordinates(text):
+    """kml coordinate tuples (lon,lat[,alt]) to lat, lon & ele arrays."""
+    tuples=text.split()
+    if len(tuples)==0:
+        return np.empty(0),np.empty(0),np.empty(0)
+
+    width=tuples[0].count(',')+1
+    if all(t.count(',')+1==width for t in tuples):
+        values=np.array(','.join(tuples).split(','),dtype=float).reshape(-1,width)
+    else:   #   mixed 2D & 3D tuples
+        width=3
+        values=np.full((len(tuples),3),np.nan)
+        for i,t in enumerate(tuples):
+            parts=t.split(',')
+            values[i,:len(parts)]=[float(part) for part in parts]
+
+    ele=values[:,2] if width>2 else None
+
+    return values[:,1],values[:,0],ele
+
+def readKml(file):
+    """Incrementally parses every LineString & gx:Track of a kml file. Each placemark, and each gx:Track point, is dropped from the tree once read.
+    gx:Track points are added to the track TRACK_CHUNK at a time; their times are kept as datetime64 until the coordinates they belong to arrive."""
+    track=TrackBuffer()
+    name=None
+    fallbackName=None
+    stack=[]
+    whens=[]    #   unparsed text of the current gx:Track, at most TRACK_CHUNK each
+    coords=[]
+    times=np.empty(TRACK_CHUNK,dtype='datetime64[ms]')  #   parsed whens of the current gx:Track
+    timeCount=0
+    coordCount=0
+    trackStart=0
+
+    def flushWhens():
+        nonlocal whens,times,timeCount
+        parsed=np.array([parseTime(when) for when in whens],dtype='datetime64[ms]')
+        if timeCount+len(parsed)>len(times):
+            grown=np.empty(max(2*len(times),timeCount+len(parsed)),dtype=times.dtype)
+            grown[:timeCount]=times[:timeCount]
+            times=grown
+        times[timeCount:timeCount+len(parsed)]=parsed
+        timeCount+=len(parsed)
+        whens=[]
+
+    def flushCoords():
+        nonlocal coords,coordCount
+        flushWhens()
+        values=np.array(' '.join(coords).split(),dtype=float).reshape(len(coords),-1)
+        time=np.full(len(coords),np.datetime64('NaT'),dtype='datetime64[ms]')
+        known=min(max(timeCount-coordCount,0),len(coords))
+        time[:known]=times[coordCount:coordCount+known]
+        track.extend(values[:,1],values[:,0],values[:,2] if values.shape[1]>2 else None,time)
+        coordCount+=len(coords)
+        coords=[]
+
+    for event,elem in ET.iterparse(file,events=('start','end')):
+        tag=localName(elem.tag)
+        if event=='start':
+            stack.append(elem)
+            if tag in ('LineString','Track'):
+                track.newSegment()
+                whens,coords=[],[]
+                timeCount=coordCount=0
+                trackStart=track.n
+            continue
+
+        stack.pop()
+        parent=localName(stack[-1].tag) if len(stack)!=0 else None
+        if tag=='coordinates' and parent=='LineString':
+            lat,lon,ele=parseCoordinates(elem.text or '')
+            track.extend(lat,lon,ele)
+            elem.clear()
+        elif tag in ('when','coord') and parent=='Track':
+            if tag=='when':
+                whens.append(elem.text)
+                if len(whens)==TRACK_CHUNK:
+                    flushWhens()
+            else:
+                coords.append(elem.text)
+                if len(coords)==TRACK_CHUNK:
+                    flushCoords()
+            elem.clear()
+            stack[-1].remove(elem)
+        elif tag=='Track':
+            if len(coords)!=0:
+                flushCoords()
+            flushWhens()
+            if timeCount!=coordCount:   #   times that don't pair up with the coordinates are dropped
+                track.time[trackStart:track.n]=np.datetime64('NaT')
+            times=np.empty(TRACK_CHUNK,dtype='datetime64[ms]')
+        elif tag=='name':
+            if parent=='Placemark' and name==None:
+                name=elem.text
+            elif parent=='Document' and fallbackName==None:
+                fallbackName=elem.text
+            continue
+
+        if tag=='Placemark':
+            elem.clear()
+            if len(stack)!=0:
+                stack[-1].remove(elem)
+
+    return (name if name!=None else fallbackName),track.columns()
@@ -0,0 +1,191 @@
+import os
+import importlib.util
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+
+import hike_data_processor
+import elevation
+import gps_import
+import instrument
+import snapshot
+
+FORMATS=('csv','json','parquet')
+POINT_COLUMNS=('segment','lat','lon','ele','timestamp','alt','dist','distSum','slope','speed','speed_smooth','time','day')
+
+#   per process state, set up by initWorker
+worker={}
+
+def initWorker(options):
+    """Opens this process's connections to the shared caches. sqlite (WAL) handles concurrent readers & writers across processes."""
+    worker['options']=options
+    if options['dem']:  #   sampled directly, never cached
+        worker['elevation_cache']=None
+        worker['elevation_provider']=elevation.LocalDEMProvider(options['dem'])
+    else:   #   the api rate limit is shared between all workers
+        worker['elevation_cache']=elevation.ElevationCache(os.path.join(options['cache_dir'],'elevation.sqlite'),options['elevation_cache_size'])
+        worker['elevation_provider']=elevation.ElevationFetcher(rate=elevation.ElevationFetcher.RATE/options['workers'])
+    if options['maps']:
+        import tiles    #   PIL & requests are only needed for maps
+        tiles.set_shared_cache(tiles.TileCache(os.path.join(options['cache_dir'],'tiles.sqlite')))
+    if options['report']:
+        instrument.recorder.enable()
+
+def routeStem(gps_file,root):
+    """Output name for a route: its path relative to the common input root, flattened."""
+    relative=os.path.relpath(os.path.splitext(gps_file)[0],root)
+
+    return relative.replace(os.sep,'__')
+
+def checkFormat(fmt):
+    """Fails before any route is analysed if the output format can't be written."""
+    if fmt=='parquet' and importlib.util.find_spec('pyarrow')==None and importlib.util.find_spec('fastparquet')==None:
+        raise ImportError("Writing parquet requires pyarrow: pip install pyarrow")
+
+def writeTable(data,file,fmt):
+    if fmt=='csv':
+        data.to_csv(file+'.csv',index=False)
+    elif fmt=='json':
+        data.to_json(file+'.json',orient='records',date_format='iso')
+    else:
+        data.to_parquet(file+'.parquet',index=False)
+
+def analyseRoute(gps_file,stem):
+    """Runs the Path pipeline for one route & writes its per-point table. Returns the route summary, and its instrumentation report if enabled."""
+    options=worker['options']
+    instrument.recorder.reset()
+    summary={'file':gps_file,'name':None,'points':0,'segments':0,'distance_km':np.nan,'time_hrs':np.nan,'ascent_m':np.nan,'descent_m':np.nan,'days':np.nan,'longest_day_hrs':np.nan,'map_tiles_skipped':np.nan,'seconds':0.0,'error':None}
+    t0=time.perf_counter()
+    try:
+        snapshot_file=snapshot.defaultFile(gps_file,options['cache_dir']) if options['snapshots'] else None
+        path=hike_data_processor.Path(gps_file,options['speed_data'],
+                                    elevation_cache=worker['elevation_cache'],
+                                    elevation_provider=worker['elevation_provider'],
+                                    snapshot_file=snapshot_file,
+                                    simplify_tolerance=options['simplify'],
+                                    map_corridor=options['map_corridor'],
+                                    smooth_window=options['smooth_window'])
+        loaded=path.analysed
+        path.analyse()
+        if snapshot_file!=None and not loaded:
+            path.saveSnapshot()
+
+        data=path.hikeData
+        totals=path.between(0,len(data)-1)
+        summary.update({
+            'name':path.name,
+            'points':len(data),
+            'segments':int(data['segment'].max())+1 if 'segment' in data and len(data)!=0 else 1,
+            'distance_km':path.distSum,
+            'time_hrs':path.timeSum,
+            'ascent_m':float(totals['ascent']),
+            'descent_m':float(totals['descent']),
+        })
+
+        if options['days']!=None or options['target_hours']!=None:
+            path.splitDays(options['days'],options['target_hours'],options['rest_km'],options['rest_lunch'])
+            day_data=path.calcDayData()
+            day_hrs=day_data['time']+day_data['dist']*options['rest_km']/60+options['rest_lunch']/60
+            summary['days']=len(day_data)
+            summary['longest_day_hrs']=float(day_hrs.max())
+
+        if options['points']:
+            columns=[column for column in POINT_COLUMNS if column in data]
+            writeTable(data[columns],os.path.join(options['output'],'points',stem),options['format'])
+        if options['map_zoom']!=None:
+            img,geometry=path.buildMap(options['tile_server'],options['map_zoom'],verbose=False)
+            img.save(os.path.join(options['output'],'maps',stem+'.png'))
+            summary['map_tiles_skipped']=geometry['tiles_skipped']
+    except Exception as error:  #   one bad route mustn't stop the batch
+        summary['error']=f"{type(error).__name__}: {error}"
+    summary['seconds']=time.perf_counter()-t0
+
+    return summary,instrument.recorder.report() if options['report'] else None
+
+def run(args):
+    checkFormat(args.format)
+    files=gps_import.find(args.routes)
+    if len(files)==0:
+        print("No gps files found.")
+        return []
+
+    root=os.path.commonpath([os.path.dirname(os.path.abspath(file)) for file in files])
+    workers=min(args.workers,len(files))
+    options={
+        'speed_data':args.speed_data,
+        'output':args.output,
+        'format':args.format,
+        'points':not args.summary_only,
+        'cache_dir':args.cache_dir,
+        'elevation_cache_size':args.elevation_cache_size,
+        'dem':args.dem,
+        'simplify':args.simplify,
+        'smooth_window':args.smooth_window,
+        'snapshots':not args.no_snapshot,
+        'map_zoom':args.map_zoom,
+        'maps':args.map_zoom!=None,
+        'map_corridor':args.map_corridor,
+        'days':args.days,
+        'target_hours':args.target_hours,
+        'rest_km':args.rest_km,
+        'rest_lunch':args.rest_lunch,
+        'tile_server':args.tile_server,
+        'workers':workers,
+        'report':args.report!=None,
+    }
+    os.makedirs(os.path.join(args.output,'points'),exist_ok=True)
+    if args.map_zoom!=None:
+        os.makedirs(os.path.join(args.output,'maps'),exist_ok=True)
+
+    print(f"Analysing {len(files)} routes on {workers} processes...")
+    summaries=[]
+    reports=[]
+    t0=time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers,initializer=initWorker,initargs=(options,)) as pool:
+        futures=[pool.submit(analyseRoute,os.path.abspath(file),routeStem(os.path.abspath(file),root)) for file in files]
+        for future in as_completed(futures):
+            summary,report=future.result()
+            summaries.append(summary)
+            if report!=None:
+                reports.append(report)
+            status='failed: '+summary['error'] if summary['error'] else f"{summary['distance_km']:.1f} km, {summary['time_hrs']:.1f} hrs"
+            print(f"[{len(summaries)}/{len(files)}] {summary['file']} {status}")
+
+    summaries.sort(key=lambda summary: summary['file'])
+    writeTable(pd.DataFrame(summaries),os.path.join(args.output,'summary'),args.format)
+    failed=sum(summary['error']!=None for summary in summaries)
+    seconds=time.perf_counter()-t0
+    print(f"Done in {seconds:.1f} s, {failed} failed. Results in {args.output}")
+
+    if args.report!=None:   #   summed over every route & worker
+        instrument.dump(instrument.merge(reports,wall_seconds=seconds),args.report or None)
+
+    return summaries
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Analyses many routes without the GUI.')
+    parser.add_argument('routes',nargs='+',help='gps files (gpx, kml, kmz), directories or glob patterns.')
+    parser.add_argument('speed_data',help='Speed (kph) against gradient data (.json)')
+    parser.add_argument('-o','--output',default='hike_results',help='Output directory.')
+    parser.add_argument('--format',choices=FORMATS,default='csv',help='Output format. parquet requires pyarrow.')
+    parser.add_argument('--summary-only',action='store_true',help="Don't write per-point tables.")
+    parser.add_argument('-j','--workers',type=int,default=os.cpu_count(),help='Number of processes.')
+    parser.add_argument('--cache-dir',default=elevation.DEFAULT_CACHE_DIR,help='Directory for the local elevation & map tile caches and route snapshots.')
+    parser.add_argument('--elevation-cache-size',type=int,default=elevation.ElevationCache.DEFAULT_MAX_ENTRIES,help='Max. number of cached elevation points.')
+    parser.add_argument('--dem',nargs='+',help='Local DEM rasters or directories (.npy + .json sidecar, GeoTIFF) used instead of opentopodata.')
+    parser.add_argument('--simplify',type=float,default=0,metavar='METRES',help='Simplify tracks so no point moves more than this. 0 keeps every point.')
+    parser.add_argument('--smooth-window',type=float,metavar='METRES',help='Smooth slope & speed over this distance around each point. Overrides "window" in the speed data.')
+    parser.add_argument('--no-snapshot',action='store_true',help='Re-analyse routes even if a snapshot of them is up to date.')
+    parser.add_argument('--days',type=int,help='Split each route into this many days of even walking time (incl. rest). Adds a day column to the point tables.')
+    parser.add_argument('--target-hours',type=float,help='Split each route into the fewest days no longer than this (incl. rest).')
+    parser.add_argument('--rest-km',type=float,default=10,help='Rest per km (mins) when splitting days.')
+    parser.add_argument('--rest-lunch',type=float,default=60,help='Additional rest per day (mins) when splitting days.')
+    parser.add_argument('--map-zoom',type=int,help='Also save a map image of each route at this zoom level.')
+    parser.add_argument('--map-corridor',type=float,metavar='METRES',help='Only download map tiles this close to the route, the rest is filled from a lower zoom.')
+    parser.add_argument('--tile-server',type=int,default=2,help='Index of the map tile server (see Path.tileServers).')
+    parser.add_argument('--report',nargs='?',const='',metavar='FILE',help='Time each stage & count api calls, cache hits, tiles... summed over all routes. Printed, or written to FILE (.json).')
+    args=parser.parse_args()
+
+    run(args)
@@ -1,14 +1,19 @@
 from tkinter import Tk, ttk, Button, Scale, Canvas, Frame, Label, StringVar, Entry,filedialog
 from PIL import ImageTk
 import os
+import threading
 import numpy as np
 import pandas as pd
 from colorutils import hsv_to_hex
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from scipy import spatial
 from argparse import ArgumentParser
 
 import hike_data_processor
+import elevation
+import instrument
+import snapshot
+import tiles
+import route_engine
+import strokes
 
 class Paint(object):
 
@@ -21,43 +26,180 @@ class Paint(object):
     DEFAULT_SERVER=2
     DEFAULT_REST_KM=10
     DEFAULT_REST_LUNCH=60
+    TRACE_TOLERANCE=0.5 #   px, trace detail finer than this isn't drawn
+    TRACE_CHUNK=2000    #   points per trace polyline
+    ZOOMS=range(10,17)  #   zoom slider range, prefetched around the current level
+    POLL=100    #   ms between checks on background work
+    HOVER_RADIUS=10 #   px, max. distance of the cursor from the trace for a readout
 
     def __init__(self,path):
         self.path=path
         self.tile_server=self.DEFAULT_SERVER
         self.zoom=self.DEFAULT_ZOOM
+        self.trace_cache={}   #   projected trace & simplified lines per (zoom,width,height)
+        self.trace_lines={}
+        self.trace_trees={}
+        self.pyramid=tiles.MapPyramid(self.prepareMap)
+
+        #   route columns the canvas needs, copied so drawing never reads hikeData while it is being analysed, nor holds a snapshot's mapping open
+        self.route_lat=path.hikeData['lat'].to_numpy(copy=True)
+        self.route_lon=path.hikeData['lon'].to_numpy(copy=True)
+        self.route_segment=path.hikeData['segment'].to_numpy(copy=True) if 'segment' in path.hikeData else np.zeros(len(self.route_lat),dtype=int)
+
+        #   written by background workers, read by poll() on the tkinter thread
+        self.partialMap=None    #   (server,zoom,img,box,done,total) of the mosaic being downloaded
+        self.partialElevation=None  #   (dist,alts) downloaded so far
+        self.analysisDone=False
+        self.analysisError=None
+
+        self.shownMap=None  #   (server,zoom) whose finished map is on the canvas
+        self.shownPartial=None
+        self.shownElevation=None
+        self.elevationShown=False
+
+        self.autoDays=None  #   day of every point from autoSplit, painted lines override it
+        self.profile_cursor=None    #   vertical line on the elevation plot at the hovered point
 
         self.window = Tk()
 
-        self.scaleImg(self.zoom)
-        self.ui_layout(path.name,path.tileServers,path.elevation())
+        #   window opens with the route outline; map & elevations fill in as they arrive
+        self.showMap(None,self.path.mapGeometry(self.zoom))
+        self.ui_layout(path.name,path.tileServers,path.plotElevation())
         self.mapCoord_to_canvasCoord()
         self.defaults()
 
         self.draw_gps_trace()
 
-        self.clear_canvas()
+        self.drawStrokes()
+
+        self.pyramid.request(self.tile_server,self.zoom)
+        threading.Thread(target=self.analyseRoute,daemon=True).start()
+        self.window.after(self.POLL,self.poll)
 
     def start(self):
+        self.window.protocol('WM_DELETE_WINDOW',self.close)
         self.window.mainloop()
 
-    def scaleImg(self,zoom):
-        self.img=self.path.getMap(tile_server=self.tile_server,zoom=zoom)
+    def close(self):
+        """Saves the analysed route, painted days & rest settings before closing."""
+        if self.path.snapshotFile!=None and self.path.analysed:
+            self.figure.clear() #   the profile lines view a loaded snapshot's columns, which must be let go before it is replaced
+            self.path.saveSnapshot(settings={
+                'days':len(self.day_buttons),
+                'rest_km':self.rest_km_entry.get(),
+                'rest_lunch':self.rest_lunch_entry.get(),
+                'target_hours':self.target_hours_entry.get(),
+                'painting':self.strokes.toDict(),
+            })
+        self.pyramid.close()
+        self.window.destroy()
+
+    def analyseRoute(self):
+        """Elevation & speed calculation. Runs on a background thread, so mustn't touch tkinter."""
+        def landed(dist,alts):
+            self.partialElevation=(dist,alts)
+
+        try:
+            self.path.analyse(progress=landed)
+        except Exception as error:
+            self.analysisError=error
+        self.analysisDone=True
+
+    def poll(self):
+        """Moves background work into the UI: map tiles as they land & the elevation profile as chunks return."""
+        self.pollMap()
+        self.pollElevation()
+        self.window.after(self.POLL,self.poll)
+
+    def pollMap(self):
+        key=(self.tile_server,self.zoom)
+        if self.shownMap==key:
+            return
+
+        prepared=self.pyramid.get(*key)
+        if prepared!=None:
+            self.setImage(prepared[0])
+            self.shownMap=key
+            self.status_map.set('')
+            self.pyramid.prefetch(self.tile_server,self.zoom,self.ZOOMS)
+            return
 
-        #scale image to max window dimensions
-        aspect_ratio=self.img.width/self.img.height
-        if self.img.width>self.img.height:
-            scaled_size=(self.MAX_WIDTH, int(self.MAX_WIDTH/aspect_ratio))
-            self.img=self.img.resize(scaled_size)
-        elif self.img.height>self.img.width:
-            scaled_size=(int(self.MAX_HEIGHT*aspect_ratio), self.MAX_HEIGHT)
-            self.img=self.img.resize(scaled_size)
-        self.img=ImageTk.PhotoImage(self.img)
+        error=self.pyramid.error(*key)
+        if error!=None:
+            self.shownMap=key
+            self.status_map.set(f'Map failed: {error}')
+            return
 
-        self.width=self.img.width()
-        self.height=self.img.height()
+        partial=self.partialMap
+        if partial==None or partial[:2]!=key or partial[4:]==self.shownPartial:
+            return
+        server,zoom,img,box,done,total=partial
+        self.shownPartial=(done,total)
+        self.status_map.set(f'Map tiles: {done}/{total}')
+        if not self.mapPreviewed:   #   tiles as they land, unless a resampled level is already showing
+            with self.path.mapLock:
+                img=img.crop(box)
+            self.setImage(img.resize((self.width,self.height)))
+
+    def pollElevation(self):
+        if self.elevationShown:
+            return
 
-        return
+        if self.analysisDone:
+            self.elevationShown=True
+            if self.analysisError!=None:
+                self.status_elevation.set(f'Elevation failed: {self.analysisError}')
+                return
+            self.status_elevation.set('')
+            self.path.plotElevation(fig=self.figure)
+            self.plot.draw_idle()
+            if 'day' in self.path.hikeData: #   day stats painted in a previous session
+                self.showDayData(self.path.calcDayData())
+            return
+
+        partial=self.partialElevation
+        if partial!=None and partial is not self.shownElevation:
+            self.shownElevation=partial
+            dist,alts=partial
+            self.status_elevation.set(f'Elevations: {100*np.count_nonzero(~np.isnan(alts))/max(len(alts),1):.0f}%')
+            self.path.plotElevation(fig=self.figure,dist=dist,alt=alts)
+            self.plot.draw_idle()
+
+    def fitSize(self,geometry):
+        """Map size scaled to max window dimensions."""
+        width=geometry['x1']-geometry['x0']
+        height=geometry['y1']-geometry['y0']
+        aspect_ratio=width/height
+        if width>height:
+            return (self.MAX_WIDTH, int(self.MAX_WIDTH/aspect_ratio))
+        elif height>width:
+            return (int(self.MAX_HEIGHT*aspect_ratio), self.MAX_HEIGHT)
+
+        return (int(width),int(height))
+
+    @instrument.timed('paint.prepareMap')
+    def prepareMap(self,tile_server,zoom,verbose=False):
+        """Builds a map scaled to the window. Runs on the pyramid's background threads, so mustn't touch tkinter."""
+        def landed(img,box,done,total):
+            self.partialMap=(tile_server,zoom,img,box,done,total)
+
+        img,geometry=self.path.buildMap(tile_server,zoom,verbose,progress=landed)
+        with instrument.stage('paint.resize'):
+            img=img.resize(self.fitSize(geometry))
+
+        return img,geometry
+
+    def showMap(self,img,geometry):
+        """Makes geometry the current map. img is already scaled to fitSize, or None while it downloads."""
+        self.path.setMapGeometry(geometry)
+        self.width,self.height=self.fitSize(geometry)
+        self.img=None if img==None else ImageTk.PhotoImage(img)
+        self.mapPreviewed=img!=None
+
+    @instrument.timed('paint.setImage')
+    def setImage(self,img):
+        self.img=ImageTk.PhotoImage(img)
+        self.canvas.itemconfig('image',image=self.img)
 
     def ui_layout(self,name,tileServers,figure):
         """Defines initial UI layout. Adds widgets to window."""
@@ -90,7 +232,7 @@ class Paint(object):
             zoomLabel2=Label(tileFrame,text=zoomScale.get())
             zoomLabel2.grid(row=0,column=6)
         
-        zoomScale=Scale(tileFrame,from_=10,to=16,orient='horizontal',showvalue=0,command=update_zoom_label)
+        zoomScale=Scale(tileFrame,from_=self.ZOOMS[0],to=self.ZOOMS[-1],orient='horizontal',showvalue=0,command=update_zoom_label)
         zoomScale.grid(row=0,column=5) 
         zoomScale.set(self.DEFAULT_ZOOM)
         update_zoom_label(self.DEFAULT_ZOOM)
@@ -110,10 +252,29 @@ class Paint(object):
         #self.canvas.place(relwidth=0.5,relheight=0.5,anchor='n')
         #   </canvas>
 
+        #   <loading status>
+        statusFrame=Frame(left,bd=3)
+        statusFrame.grid(row=1,column=0,sticky='nsew')
+
+        self.status_map=StringVar(left,'Map tiles: waiting')
+        Label(statusFrame,textvariable=self.status_map).grid(row=0,column=0)
+        self.status_elevation=StringVar(left,'' if self.path.analysed else 'Elevations: waiting')
+        Label(statusFrame,textvariable=self.status_elevation).grid(row=0,column=1)
+        self.status_point=StringVar(left,'')
+        Label(statusFrame,textvariable=self.status_point).grid(row=0,column=2)
+        #   </loading status>
+
         #   <elevation plot>      
-        plot=FigureCanvasTkAgg(figure, master=left)  # A tk.DrawingArea.
-        plot.draw()
-        plot.get_tk_widget().grid(row=3,column=0)
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+
+        self.figure=figure
+        self.plot=FigureCanvasTkAgg(figure, master=left)  # A tk.DrawingArea.
+        self.plot.draw()
+        self.plot.get_tk_widget().grid(row=3,column=0)
+
+        toolbar=NavigationToolbar2Tk(self.plot,left,pack_toolbar=False)   #   zoom & pan along the route
+        toolbar.update()
+        toolbar.grid(row=4,column=0,sticky='w')
         #   </elevation plot>
 
         ############## RIGHT SECTION (paint controls & other buttons) ##############
@@ -131,8 +292,11 @@ class Paint(object):
         self.size_scale = Scale(paint_options,from_=20,to=60,resolution=20,orient='horizontal',label='Brush size:')
         self.size_scale.grid(row=0,column=0,sticky='nsew')
 
+        self.undo_button = Button(paint_options, text='Undo',command=self.undo)
+        self.undo_button.grid(row=1,column=0,sticky='nsew')
+
         self.clear_button = Button(paint_options, text='Clear Paint',command=self.clear_canvas)
-        self.clear_button.grid(row=1,column=0,sticky='nsew')
+        self.clear_button.grid(row=2,column=0,sticky='nsew')
         #   </paint brush control
 
         #   <day selection>
@@ -163,12 +327,20 @@ class Paint(object):
         self.rest_lunch_entry=Entry(options,width=5)
         self.rest_lunch_entry.grid(row=1,column=1)
 
+        target_hours=Label(options,text='Target hrs per day (optional): ')
+        target_hours.grid(row=2,column=0)
+        self.target_hours_entry=Entry(options,width=5)
+        self.target_hours_entry.grid(row=2,column=1)
+
+        self.autoSplitButton = Button(options, text="Auto Split Days",command=self.autoSplit)
+        self.autoSplitButton.grid(row=3,column=0,columnspan=2,sticky='nsew')
+
         self.getLinesButton = Button(options, text="Compute Day Stats",command=self.refreshDayDisp)
-        self.getLinesButton.grid(row=2,column=0,columnspan=2,sticky='nsew')
+        self.getLinesButton.grid(row=4,column=0,columnspan=2,sticky='nsew')
 
         columns=('day','dist','time')
         self.day_disp=ttk.Treeview(options,columns=columns,show='headings')
-        self.day_disp.grid(row=3,column=0,columnspan=2,sticky='nsew')
+        self.day_disp.grid(row=5,column=0,columnspan=2,sticky='nsew')
 
         self.day_disp.column('day',width=30)
         self.day_disp.column('dist',width=50)
@@ -186,22 +358,27 @@ class Paint(object):
         self.old_x, self.old_y = None, None
         self.active_button = None
         self.size_multiplier = 1
-        self.lineList=[]  
 
         self.add_image()
         self.canvas.bind('<B1-Motion>', self.paint)  #   Binds paint function to mouse motion when mousebutton1 clicked. Passes event object eg. event.x, event.y
         self.canvas.bind('<ButtonRelease-1>', self.reset)
+        self.canvas.bind('<Motion>', self.hover)
+        self.window.bind('<Control-z>', self.undo)
+        self.plot.mpl_connect('motion_notify_event',self.profileHover)
         self.day_input.bind('<Return>',lambda event: self.update_day_buttons(self.day_input.get()))
 
         self.tileSelect.current(self.tile_server)
 
+        settings=self.path.settings #   restored from a snapshot, if there was one
+        self.strokes=strokes.StrokeStore.fromDict(settings['painting']) if 'painting' in settings else strokes.StrokeStore()
+        days=settings.get('days',self.DEFAULT_DAYS)
         self.day_buttons=[]
-        self.day_input.insert(0,str(self.DEFAULT_DAYS))
-        self.update_day_buttons(self.DEFAULT_DAYS)
-        self.rest_lunch_entry.insert(0,str(self.DEFAULT_REST_LUNCH))
-        self.rest_km_entry.insert(0,str(self.DEFAULT_REST_KM))
-        self.colour=self.colour_list[0]
         self.day=0
+        self.day_input.insert(0,str(days))
+        self.update_day_buttons(days)
+        self.rest_lunch_entry.insert(0,str(settings.get('rest_lunch',self.DEFAULT_REST_LUNCH)))
+        self.rest_km_entry.insert(0,str(settings.get('rest_km',self.DEFAULT_REST_KM)))
+        self.target_hours_entry.insert(0,str(settings.get('target_hours','')))
 
         self.line_start = (None, None)
 
@@ -217,6 +394,8 @@ class Paint(object):
             days=int(days)
         except:
             return
+        if days<1:
+            return
 
         #   Deletes buttons and widgets from frame
         if len(self.day_buttons)!=0:
@@ -225,6 +404,8 @@ class Paint(object):
                     widget.grid_forget()                #   Removes widget from frame
 
         self.colour_list=[self.generateColour(id) for id in np.linspace(0,256,days)]    #   Generate colours
+        self.day=min(self.day,days-1)   #   paints with the last day if the selected one was removed
+        self.colour=self.colour_list[self.day]
 
         self.day_buttons=[] #   Resets button list
         for day in range(days):   
@@ -240,56 +421,94 @@ class Paint(object):
             day_label.grid(row=day+2,column=1,sticky='nsew')
 
             #   Recolours lines
-            if self.lineList!=[]:
-                del_lines=[]
-                for i,line in enumerate(self.lineList):
-                    line_day=int(self.canvas.gettags(line)[1])  #   gets day tag from line on canvas
-   
-                    if line_day>=days:  #   if the line is for a day that has been removed
-                        del_lines.append(line)
+            self.canvas.itemconfig(f'day{day}',fill=self.colour_list[day])
 
-                    if line_day==day:
-                        self.canvas.itemconfig(line,fill=self.colour_list[day]) #   recolours line
+        #   Deletes lines for days that have been removed
+        for id in self.strokes.dropDays(days):
+            self.canvas.delete(f'stroke{id}')
 
-                for line in del_lines:
-                    self.canvas.delete(line)
-                    self.lineList.remove(line)
+        #   Recolours the auto split, or drops it if it has more days than there are now
+        if self.autoDays is not None:
+            if self.autoDays.max()>=days:
+                self.autoDays=None
+            self.drawAutoDays()
 
         return
 
+    @instrument.timed('paint.refreshMap')
     def refreshMap(self,tile_server,zoom):
         self.tile_server=tile_server
-        self.scaleImg(zoom)
+        self.zoom=zoom
+        self.shownMap=None
+
+        geometry=self.path.mapGeometry(zoom)
+        prepared=self.pyramid.get(tile_server,zoom)
+        nearest=self.pyramid.nearest(tile_server,zoom)
+        if prepared!=None:
+            img=prepared[0]
+        elif nearest!=None: #   resampled nearest level until the real tiles arrive
+            img=nearest[2][0].resize(self.fitSize(geometry))
+        else:
+            img=None
+        if prepared==None:
+            self.pyramid.request(tile_server,zoom)
+        self.showMap(img,geometry)
+
         self.canvas.delete('all')
-        self.lineList=[] 
         self.add_image()
         self.mapCoord_to_canvasCoord()
         self.draw_gps_trace()
+        self.drawAutoDays()
+        self.drawStrokes()
 
         return
 
     def add_image(self):
         self.canvas.create_image(self.width/2,self.height/2,image=self.img,tags='image')
 
+    @instrument.timed('paint.mapCoord_to_canvasCoord')
     def mapCoord_to_canvasCoord(self):
-        "Converts gps trace map coordinates to tkinter canvas coordinates"
-        
+        "Converts gps trace map coordinates to tkinter canvas coordinates. Cached per zoom level & canvas size."
+        key=(self.path.zoom,self.width,self.height)
+        if key in self.trace_cache:
+            self.gps_trace=self.trace_cache[key]
+            return
+
         wscale=self.width/(self.path.x1-self.path.x0) #   Scale factor between map coordinates & canvas
         hscale=self.height/(self.path.y1-self.path.y0)
 
-        self.gps_trace=[]   #   In canvas coordinates!
-        for index,row in self.path.hikeData.iterrows():
-            x,y=self.path.coord_to_pixels(row['lat'],row['lon'],tile_size=self.path.TILE_SIZE)    #   Gets gps trace coordinates
-            
-            x_=(x-self.path.x0)*wscale
-            y_=self.height+(y-self.path.y1)*hscale #   Canvas origin is in top left, i.e. x0,y1 in map coordinates
-
-            self.gps_trace.append([x_,y_,])
+        x,y=self.path.coord_to_pixels(self.route_lat,self.route_lon,tile_size=self.path.TILE_SIZE)    #   Gets gps trace coordinates
 
-        self.gps_trace=np.array(self.gps_trace)
+        self.gps_trace=np.empty((len(x),2))   #   In canvas coordinates!
+        self.gps_trace[:,0]=(x-self.path.x0)*wscale
+        self.gps_trace[:,1]=self.height+(y-self.path.y1)*hscale #   Canvas origin is in top left, i.e. x0,y1 in map coordinates
+        self.trace_cache[key]=self.gps_trace
 
         return
 
+    def canvasScale(self):
+        """Canvas pixels per map unit at zoom 0, in x & y."""
+        scale=2**self.path.zoom
+
+        return self.width/(self.path.x1-self.path.x0)*scale,self.height/(self.path.y1-self.path.y0)*scale
+
+    def canvasToMap(self,x,y):
+        """Canvas coordinates to map coordinates at zoom 0, which don't change with zoom or canvas size."""
+        wscale,hscale=self.canvasScale()
+        scale=2**self.path.zoom
+
+        return x/wscale+self.path.x0/scale,(y-self.height)/hscale+self.path.y1/scale
+
+    def mapToCanvas(self,xy):
+        """Map coordinates at zoom 0 (n,2) to canvas coordinates, as mapCoord_to_canvasCoord."""
+        wscale,hscale=self.canvasScale()
+        scale=2**self.path.zoom
+        canvas=np.empty((len(xy),2))
+        canvas[:,0]=(xy[:,0]-self.path.x0/scale)*wscale
+        canvas[:,1]=self.height+(xy[:,1]-self.path.y1/scale)*hscale
+
+        return canvas
+
     def generateColour(self,n):
         hue=n
         sat=0.7
@@ -297,87 +516,231 @@ class Paint(object):
 
         return hsv_to_hex((hue,sat,vib))
 
+    @instrument.timed('paint.draw_gps_trace')
     def draw_gps_trace(self):
-        for i,_ in enumerate(self.gps_trace):
-            if i+1!=len(self.gps_trace):    #   stops 1 before the end
-                self.canvas.create_line(self.gps_trace[i,0],self.gps_trace[i,1],self.gps_trace[i+1,0],self.gps_trace[i+1,1],
+        """Draws the trace as a few polylines, simplified to the screen resolution (nothing finer than a pixel)."""
+        for points in self.traceLines():
+            for i in range(0,len(points)-1,self.TRACE_CHUNK-1):  #   chunks share their end point
+                self.canvas.create_line(*points[i:i+self.TRACE_CHUNK].ravel().tolist(),
                                     width=3, fill='black',
-                                    capstyle='round', smooth=True, splinesteps=36,
+                                    capstyle='round', joinstyle='round',
                                     tags='gps_trace')
         
         return
 
+    @instrument.timed('paint.traceLines')
+    def traceLines(self):
+        """Simplified canvas points of each track segment. Cached with the projection."""
+        key=(self.path.zoom,self.width,self.height)
+        if key in self.trace_lines:
+            return self.trace_lines[key]
+
+        bounds=np.concatenate(([0],np.flatnonzero(np.diff(self.route_segment)!=0)+1,[len(self.gps_trace)]))
+        lines=[]
+        for start,end in zip(bounds[:-1],bounds[1:]):
+            points=self.gps_trace[start:end]
+            lines.append(points[route_engine.douglas_peucker(points[:,0],points[:,1],self.TRACE_TOLERANCE)])
+        self.trace_lines[key]=lines
+
+        return lines
+
+    @instrument.timed('paint.drawAutoDays')
+    def drawAutoDays(self):
+        """Overlays the auto split on the trace in the day colours, below any painted lines."""
+        self.canvas.delete('auto')
+        if self.autoDays is None:
+            return
+
+        bounds=np.concatenate(([0],np.flatnonzero((np.diff(self.autoDays)!=0)|(np.diff(self.route_segment)!=0))+1,[len(self.gps_trace)]))
+        for start,end in zip(bounds[:-1],bounds[1:]):
+            points=self.gps_trace[start:end]
+            points=points[route_engine.douglas_peucker(points[:,0],points[:,1],self.TRACE_TOLERANCE)]
+            for i in range(0,len(points)-1,self.TRACE_CHUNK-1):
+                self.canvas.create_line(*points[i:i+self.TRACE_CHUNK].ravel().tolist(),
+                                    width=5, fill=self.colour_list[self.autoDays[start]],
+                                    capstyle='round', joinstyle='round',
+                                    tags='auto')
+        self.canvas.tag_raise('line')
+
+    @instrument.timed('paint.autoSplit')
+    def autoSplit(self):
+        """Splits the route into days of even walking time incl. rests: into the number of days, or the fewest days within the target hours if given.
+        Painted lines are kept & override the split where they cover the route."""
+        if not self.path.analysed:  #   needs walking times
+            return
+
+        try:    #   does nothing if inputs are not numbers
+            rest_km=float(self.rest_km_entry.get())
+            rest_lunch=float(self.rest_lunch_entry.get())
+            target=self.target_hours_entry.get().strip()
+            if target!='':
+                day=self.path.splitDays(target_hours=float(target),rest_km=rest_km,rest_lunch=rest_lunch)
+            else:
+                day=self.path.splitDays(days=len(self.day_buttons),rest_km=rest_km,rest_lunch=rest_lunch)
+        except ValueError:
+            return
+
+        self.autoDays=None
+        days=int(day.max())+1 if len(day)!=0 else 1
+        if days!=len(self.day_buttons):
+            self.day_input.delete(0,'end')
+            self.day_input.insert(0,str(days))
+            self.update_day_buttons(days)
+        self.autoDays=day
+        self.drawAutoDays()
+        self.refreshDayDisp()
+
+    def hover(self,event):
+        """Readout of distance, time & climb from the start to the route point under the cursor."""
+        if not self.path.analysed:
+            return
+
+        key=(self.path.zoom,self.width,self.height)
+        if key not in self.trace_trees:
+            from scipy import spatial
+            self.trace_trees[key]=spatial.cKDTree(self.gps_trace)
+        distance,point=self.trace_trees[key].query((event.x,event.y))
+        if distance>self.HOVER_RADIUS:
+            self.showPoint(None)
+            return
+
+        self.showPoint(point)
+
+    def profileHover(self,event):
+        """Readout & map marker for the point at the distance under the cursor on the elevation plot."""
+        if not self.path.analysed:
+            return
+
+        if event.inaxes==None:
+            self.showPoint(None)
+            return
+
+        self.showPoint(int(self.path.index.locate(event.xdata)))
+
+    def showPoint(self,point):
+        """Marks a route point on the map & elevation plot, with distance, time & climb from the start. None clears the marks."""
+        self.canvas.delete('cursor')
+        axes=self.figure.axes
+        if self.profile_cursor!=None and (len(axes)==0 or self.profile_cursor.axes is not axes[0]):  #   the plot was redrawn
+            self.profile_cursor=None
+        if point==None:
+            self.status_point.set('')
+            if self.profile_cursor!=None and self.profile_cursor.get_visible():
+                self.profile_cursor.set_visible(False)
+                self.plot.draw_idle()
+            return
+
+        x,y=self.gps_trace[point]
+        r=self.DEFAULT_PEN_SIZE
+        self.canvas.create_oval(x-r,y-r,x+r,y+r,outline='black',fill='white',width=2,tags='cursor')
+
+        totals=self.path.between(0,point)
+        self.status_point.set(f"{totals['dist']:.1f} km, {totals['time']:.1f} hrs, +{totals['ascent']:.0f}/-{totals['descent']:.0f} m from start")
+
+        if len(axes)==0:
+            return
+        if self.profile_cursor==None:
+            self.profile_cursor=axes[0].axvline(totals['dist'],color='b',linewidth=1)
+        else:
+            self.profile_cursor.set_xdata([totals['dist'],totals['dist']])
+            self.profile_cursor.set_visible(True)
+        self.plot.draw_idle()
+
     def clear_canvas(self):
         self.canvas.delete("line")
-        self.lineList=[]    
+        self.strokes.clear()
 
     def paint(self, event):
-        """Handles painting on canvas."""
+        """Handles painting on canvas. Points go into the stroke store; the segments drawn while dragging are merged into one polyline on release."""
 
         line_width = self.size_scale.get() * self.size_multiplier
         paint_colour = self.colour #   erasor uses same function as paint, just with white colour
-        day=self.day
-        if self.old_x and self.old_y:
-            self.lineList.append(self.canvas.create_line(self.old_x, self.old_y, event.x, event.y,    #   Connects last mouse coords with current mouse coords
+        if self.old_x!=None:
+            self.canvas.create_line(self.old_x, self.old_y, event.x, event.y,    #   Connects last mouse coords with current mouse coords
                                width=line_width, fill=paint_colour,
-                               capstyle='round', smooth=True, splinesteps=36,
+                               capstyle='round',
                                stipple='gray75',
-                               tags=("line",day,line_width)))
+                               tags=("line","drawing"))
+        else:
+            self.strokes.begin(self.day,line_width/2/self.canvasScale()[0])
+        self.strokes.add(*self.canvasToMap(event.x,event.y))
         
         self.old_x = event.x
         self.old_y = event.y
 
     def reset(self, event=None):
+        ended=self.old_x!=None
         self.old_x, self.old_y = None, None
+        if ended:   #   end of a stroke
+            self.canvas.delete('drawing')
+            self.drawStroke(len(self.strokes)-1)
+
+    def drawStroke(self,i):
+        """Draws the i-th stroke as one polyline, tagged with its id & day."""
+        id,day,radius,points=self.strokes.stroke(i)
+        points=self.mapToCanvas(points)
+        if len(points)==1:  #   a click draws a dot
+            points=np.repeat(points,2,axis=0)
+        self.canvas.create_line(*points.ravel().tolist(),
+                            width=2*radius*self.canvasScale()[0], fill=self.colour_list[day],
+                            capstyle='round', joinstyle='round',
+                            stipple='gray75',
+                            tags=("line",f'stroke{id}',f'day{day}'))
+
+    @instrument.timed('paint.drawStrokes')
+    def drawStrokes(self):
+        self.canvas.delete('line')
+        for i in range(len(self.strokes)):
+            self.drawStroke(i)
+
+    def undo(self, event=None):
+        """Removes the last painted stroke."""
+        id=self.strokes.undo()
+        if id!=None:
+            self.canvas.delete(f'stroke{id}')
 
     def set_day(self,day,colour):
         self.day=day
         self.colour=colour
 
+    @instrument.timed('paint.getPaintData')
     def getPaintData(self):
-        # canvas.coords in format [x0,y0,x1,y1]
-        paintCoords=[]
-        paintColours=[]
-        paintRadius=[]
-        for i,line in enumerate(self.lineList):
-            if i==0:    #   start coordinate
-                x=self.canvas.coords(self.lineList[i])[0]
-                y=self.canvas.coords(self.lineList[i])[1]
-
-                paintCoords.append([x,y])
-            else:
-                x=self.canvas.coords(line)[2]
-                y=self.canvas.coords(line)[3]
-
-                paintCoords.append([x,y])   #   gets end coordinate of each line
+        """Every painted point in canvas coordinates, with its day & brush radius (px). Read from the stroke store, no Tk calls."""
+        xy,day,radius=self.strokes.pointData()
 
-            paintColours.append(self.canvas.gettags(line)[1])
-            paintRadius.append(float(self.canvas.gettags(line)[2])/2)
-
-        paint_data=pd.DataFrame(data=paintCoords,columns=['x','y'])
-        paint_data['day']=paintColours
-        paint_data['radius']=paintRadius
+        instrument.count('paint.strokes',len(self.strokes))
+        instrument.count('paint.points',len(xy))
+        paint_data=pd.DataFrame(data=self.mapToCanvas(xy),columns=['x','y'])
+        paint_data['day']=day
+        paint_data['radius']=radius*self.canvasScale()[0]
 
         return paint_data
 
-    def find_neighbour(self,point,point_array):
-        """Employes a KDTree to find nearest neighbour"""
-        distance,nearestIndex=spatial.KDTree(point_array).query(point)
+    @instrument.timed('paint.find_neighbour')
+    def find_neighbour(self,points,point_array):
+        """Employes a single KDTree to find the nearest neighbour of every point in one batched query"""
+        from scipy import spatial   #   only needed once days are painted
+
+        distance,nearestIndex=spatial.cKDTree(point_array).query(points)
 
         return distance,nearestIndex
 
+    @instrument.timed('paint.calcDays')
     def calcDays(self):
-        paint_data=self.getPaintData()
-
-        gps_day=[]
-        for i,coord in enumerate(self.gps_trace):
-            distance,index=self.find_neighbour(coord,paint_data[['x','y']]) #   finds 
-            paint_radius=paint_data.iloc[index]['radius']
-
-            if distance<=paint_radius:
-                gps_day.append(int(paint_data.iloc[index]['day']))
-            else:
-                gps_day.append(pd.NA)
+        #   auto split days where nothing is painted
+        n=len(self.gps_trace)
+        if self.autoDays is None:
+            gps_day=pd.arrays.IntegerArray(np.zeros(n,dtype=np.int64),np.ones(n,dtype=bool))
+        else:
+            gps_day=pd.arrays.IntegerArray(self.autoDays.astype(np.int64),np.zeros(n,dtype=bool))
+
+        if len(self.strokes)!=0:
+            paint_data=self.getPaintData()
+
+            #   nearest paint point to every gps point, painted if within the brush radius
+            distance,index=self.find_neighbour(self.gps_trace,paint_data[['x','y']].to_numpy())
+            painted=distance<=paint_data['radius'].to_numpy()[index]
+            gps_day[painted]=paint_data['day'].to_numpy()[index[painted]]
         self.path.hikeData['day']=gps_day
         
         day_data=self.path.calcDayData()
@@ -385,10 +748,12 @@ class Paint(object):
         return day_data
 
     def refreshDayDisp(self):
-        if len(self.lineList)==0:
+        if (len(self.strokes)==0 and self.autoDays is None) or not self.path.analysed:    #   nothing painted or speeds & times are still being calculated
             return
 
-        day_data=self.calcDays()
+        self.showDayData(self.calcDays())
+
+    def showDayData(self,day_data):
         if self.day_disp.get_children()!=():
             self.day_disp.delete(*self.day_disp.get_children())
 
@@ -404,10 +769,31 @@ if __name__ == '__main__':
     parser=ArgumentParser()
     parser.add_argument('gps_path',help='Input gps path file (gpx, kml, kmz).')
     parser.add_argument('speed_data',help='Speed (kph) against gradient data (.json)')
+    parser.add_argument('--cache-dir',default=elevation.DEFAULT_CACHE_DIR,help='Directory for the local elevation & map tile caches and route snapshots.')
+    parser.add_argument('--elevation-cache-size',type=int,default=elevation.ElevationCache.DEFAULT_MAX_ENTRIES,help='Max. number of cached elevation points.')
+    parser.add_argument('--tile-cache-size',type=int,default=tiles.TileCache.DEFAULT_MAX_BYTES//2**20,help='Max. size of the local map tile cache (MB).')
+    parser.add_argument('--simplify',type=float,default=0,metavar='METRES',help='Simplify the track so no point moves more than this (e.g. 12.5 for half the 25 m DEM grid). 0 keeps every point.')
+    parser.add_argument('--smooth-window',type=float,metavar='METRES',help='Smooth slope & speed over this distance around each point (e.g. 50 or 100), so timings don\'t depend on gps sampling density. Overrides "window" in the speed data.')
+    parser.add_argument('--map-corridor',type=float,metavar='METRES',help='Only download map tiles this close to the route; the rest of the map is filled from a lower zoom. Saves downloads on long or diagonal routes.')
+    parser.add_argument('--snapshot',help='Route snapshot file. Defaults to one per gps file in the cache directory.')
+    parser.add_argument('--dem',nargs='+',help='Local DEM rasters or directories (.npy + .json sidecar, GeoTIFF) used instead of opentopodata.')
+    parser.add_argument('--report',nargs='?',const='',metavar='FILE',help='Time each stage & count api calls, cache hits, tiles... Printed at exit, or written to FILE (.json).')
+    parser.add_argument('--profile',action='store_true',help='Adds a cProfile of the main thread to the report. Implies --report.')
     args=parser.parse_args()
 
+    if args.report!=None or args.profile:
+        instrument.reportAtExit(args.report or None,profile=args.profile)
+
     gps_file=args.gps_path
     speed_file=args.speed_data
-    path=hike_data_processor.Path(gps_file, speed_file)
+    if args.dem:    #   sampled directly, never cached
+        elevation_cache=None
+        elevation_provider=elevation.LocalDEMProvider(args.dem)
+    else:
+        elevation_cache=elevation.ElevationCache(os.path.join(args.cache_dir,'elevation.sqlite'),args.elevation_cache_size)
+        elevation_provider=None
+    tiles.set_shared_cache(tiles.TileCache(os.path.join(args.cache_dir,'tiles.sqlite'),max_bytes=args.tile_cache_size*2**20))
+    snapshot_file=args.snapshot if args.snapshot else snapshot.defaultFile(gps_file,args.cache_dir)
+    path=hike_data_processor.Path(gps_file, speed_file, elevation_cache=elevation_cache, elevation_provider=elevation_provider, snapshot_file=snapshot_file, simplify_tolerance=args.simplify, map_corridor=args.map_corridor, smooth_window=args.smooth_window)
     ui=Paint(path)
     ui.start()
@@ -1,240 +1,354 @@
-from enum import unique
-import zipfile
-import xml.etree.ElementTree as ET
-import requests
 import os.path
+import copy
+import threading
 import time
 import pandas as pd
 import numpy as np
-from matplotlib import pyplot as plt
-from io import BytesIO
-from PIL import Image
-from tqdm import tqdm
 import json
 
+import elevation
+import gps_import
+import instrument
+import profile_plot
+import route_engine
+import snapshot
+
+#   matplotlib, PIL, tqdm & the tile/network modules are imported where they are first used, so route computation starts without them
+
 class Path():
     DEFAULT_ZOOM=13
     TILE_SIZE=256
-
-    def __init__(self,gps_file,speed_file,name=None):
+    PROGRESS_INTERVAL=0.25  #   s, min. time between elevation progress callbacks
+    CORRIDOR_FILL_LEVELS=3  #   map areas outside the corridor are filled from this many zoom levels lower (1/64 the tiles), 0 leaves them blank
+    tileServers=(
+        "https://c.tile.opentopomap.org", #   VERY slow on occasion 
+        "https://tile.openstreetmap.org", #   Fast, basic, no topography
+        "https://a.tile-cyclosm.openstreetmap.fr/cyclosm" #   Fast, has topography, weird colouring
+    )
+
+    def __init__(self,gps_file,speed_file,name=None,elevation_cache=None,elevation_provider=None,tile_cache=None,tile_fetcher=None,snapshot_file=None,simplify_tolerance=None,map_corridor=None,smooth_window=None):
         self.gps_file=gps_file
         self.speed_file=speed_file
         self.name=name
-        self.tileServers=(
-            "https://c.tile.opentopomap.org", #   VERY slow on occasion 
-            "https://tile.openstreetmap.org", #   Fast, basic, no topography
-            "https://a.tile-cyclosm.openstreetmap.fr/cyclosm" #   Fast, has topography, weird colouring
-        )
-
-        self.input()
-
+        self.elevationCache=elevation_cache
+        self.elevationProvider=elevation_provider   #   defaults to opentopodata api
+        self.tileCache=tile_cache   #   defaults to the cache shared by all paths
+        self.tileFetcher=tile_fetcher
+        self.simplifyTolerance=simplify_tolerance   #   metres, None keeps every point
+        self.smoothWindow=smooth_window #   metres, slope & speed smoothing window. Overrides the speed json's "window"; None in both compares adjacent points
+        self.mapCorridor=map_corridor   #   metres, only map tiles this close to the route are downloaded. None gets the whole bounding box
+        self.snapshotFile=snapshot_file #   analysed route is reopened from here if the gps & speed files are unchanged
+        self.settings={}    #   GUI settings stored alongside the snapshot
+        self.analysed=False
+        self.bounds=None
+        self.routeLine=None #   (lat,lon,segment) copied with the bounds
+        self.index=None #   route_engine.RouteIndex, built once analysed
+        self.mapLock=threading.Lock()   #   held while tiles are pasted into a mosaic, so it can be previewed from another thread
+
+        if self.snapshotFile==None or not self.loadSnapshot(self.snapshotFile):
+            self.input()
+
+    @instrument.timed('path.input')
     def input(self):
-        """Detects input file format & calls relevant import function"""
-        self.gps_filetype=os.path.splitext(self.gps_file)[1]
-        if self.gps_filetype==".gps":
-            coordinates,self.name=self.gpsImport(self.gps_file)
-        if self.gps_filetype==".kmz":
-            kml=self.kmzImport(self.gps_file)
-            coordinates,self.name=self.kmlImport(kml)
-        if self.gps_filetype==".kml":
-            coordinates,self.name=self.kmlImport(self.gps_file)
-
-        self.hikeData=pd.DataFrame(data=coordinates,columns=['lat','lon'])
-        self.hikeData['lat_rad']=self.hikeData['lat'].apply(np.radians)
-        self.hikeData['lon_rad']=self.hikeData['lon'].apply(np.radians)
+        """Reads the gps file (gpx, kml or kmz). All tracks & segments are kept, in file order. Optionally simplified to simplifyTolerance."""
+        with instrument.stage('path.parse'):
+            name,columns=gps_import.read(self.gps_file)
+        instrument.count('path.points',len(columns['lat']))
+        if self.name==None:
+            self.name=name
+
+        if self.simplifyTolerance:
+            with instrument.stage('path.simplify'):
+                keep,error=route_engine.simplify(columns['lat'],columns['lon'],self.simplifyTolerance,columns['segment'])
+            print(f"Simplified track from {len(keep)} to {np.count_nonzero(keep)} points, total distance within {100*error:.2f}% (walking time isn't checked)")
+            columns={column:values[keep] for column,values in columns.items()}
+
+        self.hikeData=pd.DataFrame(data=columns)    #   ele & timestamp only if the file has them
+        self.hikeData['lat_rad']=np.radians(self.hikeData['lat'].to_numpy())
+        self.hikeData['lon_rad']=np.radians(self.hikeData['lon'].to_numpy())
 
         return
 
     def elevation(self):
         """Handles elevation routine. Returns pyplot object."""
-        self.getElevations()
-        self.calcDist()
-        self.calcSlope()
-        self.calcSpeed()
-        self.calcTime()
+        self.analyse()
         elevationPlot=self.plotElevation()
 
         return elevationPlot
 
-    def kmzImport(self,file):
-        """Unzips kmz file."""
-        archive = zipfile.ZipFile(file, 'r')
-        kml=archive.open('doc.kml','r')
-
-        return kml
-
-    def kmlImport(self,file):
-        """Reads kml file. Gets path name, lat & lon coordinates. kml files are in xml format"""
-        root = ET.parse(file).getroot()
-        namespace=root.tag.split('}')[0]+'}'
-        doc=root.findall(f"{namespace}Document")[0]
-
-        placemark=doc.findall(f"{namespace}Placemark")[0]
-        name=placemark.findall(f"{namespace}name")[0].text
-        lineString=placemark.findall(f"{namespace}LineString")[0]
-        points=lineString.findall(f"{namespace}coordinates")[0].text.strip().split(' ')    #   comes out in lon,lat
-        points=[point[:-2] for point in points] #   removes null altitude
-
-        coordinates=[]
-        for point in points:
-            coordinates.append([float(point.split(',')[1]),float(point.split(',')[0])]) #   [lon,lat]
-        coordinates=np.array(coordinates,dtype=float)
-
-        return coordinates, name
-
-    def gpsImport(self,file):
-        """Reads gps file. Gets path name, lat & lon coordinates. gps files are in xml format"""
-        root=ET.parse(file).getroot()
-        namespace=root.tag.split('}')[0]+'}'
-
-        trk=root.findall(f"{namespace}trk")[0]
-        name=trk.findall(f"{namespace}name")[0].text
-        trkseg=trk.findall(f"{namespace}trkseg")[0]
-
-        coordinates=[]
-        for point in trkseg:
-            coordinates.append([float(point.attrib['lat']),float(point.attrib['lon'])])
-        coordinates=np.array(coordinates,dtype=float)
-
-        return coordinates,name
-
-    def getElevations(self):
-        """Gets altitude data along line from opentopodata api"""
-        n=100   #   100 API requests per call max
-        coordChunks=[self.hikeData[['lat','lon']].to_numpy()[i:i+n] for i in range(0,len(self.hikeData.index),n)]
-        url='https://api.opentopodata.org/v1/eudem25m?'
-        
-        elevations=[]  #   FORMAT: lat,lon,alt
+    @instrument.timed('path.analyse')
+    def analyse(self,progress=None):
+        """Calculates altitude, distance, slope, speed & time. Routes loaded from a snapshot are already analysed.
+        The columns are added to a copy of hikeData, which replaces it in one assignment when complete, so other threads never see a half analysed frame.
+        progress(dist,alts) is called with read-only copies of the cumulative distances & the altitudes known so far (nan elsewhere) as they arrive."""
+        if self.analysed:
+            return
+
+        worker=copy.copy(self)  #   shares the caches, providers & settings, but not the frame
+        worker.hikeData=self.hikeData.copy()
+        worker.calcDist()
+
+        landed=None
+        if progress!=None:
+            dist=worker.hikeData['distSum'].to_numpy().copy()
+            dist.flags.writeable=False
+            def landed(alts):
+                alts=np.array(alts)
+                alts.flags.writeable=False
+                progress(dist,alts)
+
+        worker.getElevations(landed)
+        worker.calcSlope()
+        worker.calcSpeed()
+        worker.calcTime()
+        worker.buildIndex()
+
+        self.elevationProvider,self.elevationCache=worker.elevationProvider,worker.elevationCache
+        self.distSum,self.timeSum,self.index=worker.distSum,worker.timeSum,worker.index
+        self.hikeData=worker.hikeData
+        self.analysed=True
+
+    @instrument.timed('path.buildIndex')
+    def buildIndex(self):
+        """Prefix sums for O(1) distance, time, ascent & descent between any two points (see route_engine.RouteIndex)."""
+        self.index=route_engine.RouteIndex(self.hikeData['dist'].to_numpy(),self.hikeData['time'].to_numpy(),self.hikeData['alt'].to_numpy())
+
+    def between(self,start,end):
+        """Distance (km), time (hrs), ascent & descent (m) walking from point start to point end. Takes scalars or arrays of points."""
+        return self.index.between(start,end)
+
+    def sourceChecksums(self):
+        elevation_source=elevation.ElevationFetcher.URL if self.elevationProvider==None else self.elevationProvider.source()   #   api (the default) or local DEM
+
+        return {'gps':snapshot.checksum(self.gps_file),'speed':snapshot.checksum(self.speed_file),'elevation':elevation_source,'simplify':self.simplifyTolerance,'smooth':self.smoothWindow}
+
+    @instrument.timed('path.saveSnapshot')
+    def saveSnapshot(self,file=None,settings=None):
+        """Stores the analysed route (all hikeData columns, incl. painted days) & settings for instant reopening."""
+        if file==None:
+            file=self.snapshotFile
+        if settings!=None:
+            self.settings=settings
+
+        #   drops views of a previously loaded snapshot first, as Windows can't replace a file that is still mapped
+        self.hikeData=self.hikeData.copy(deep=True)
+        columns={}
+        for column in self.hikeData.columns:
+            if column=='day':   #   nullable day numbers are stored as float, nan = unpainted
+                columns[column]=pd.to_numeric(self.hikeData[column]).to_numpy(dtype=float,na_value=np.nan)
+            else:
+                columns[column]=self.hikeData[column].to_numpy()
+
+        meta={
+            'name':self.name,
+            'checksums':self.sourceChecksums(),
+            'distSum':self.distSum,
+            'timeSum':self.timeSum,
+            'settings':self.settings,
+        }
+
+        snapshot.save(file,columns,meta)
+
+    @instrument.timed('path.loadSnapshot')
+    def loadSnapshot(self,file):
+        """Reopens an analysed route. Returns False if there is no snapshot or the gps/speed files have changed since it was saved."""
+        if not os.path.isfile(file):
+            return False
+        try:
+            columns,meta=snapshot.load(file)
+        except (ValueError,OSError):
+            return False
+        if meta['checksums']!=self.sourceChecksums():
+            return False
+
+        self.hikeData=pd.DataFrame(data=columns,copy=False)    #   columns stay memory mapped (pandas >= 2 keeps the arrays of a dict as given)
+        if self.name==None:
+            self.name=meta['name']
+        self.distSum=meta['distSum']
+        self.timeSum=meta['timeSum']
+        self.settings=meta['settings']
+        self.buildIndex()
+        self.analysed=True
+
+        return True
+
+    @instrument.timed('path.getElevations')
+    def getElevations(self,progress=None):
+        """Gets altitude data along line. Cached altitudes are used first, the rest come from the elevation provider (opentopodata api by default)
+        progress(alts) is called every PROGRESS_INTERVAL with the altitudes known so far."""
+        if self.elevationProvider==None:
+            self.elevationProvider=elevation.ElevationFetcher()
+
+        coords=self.hikeData[['lat','lon']].to_numpy()
+        if not self.elevationProvider.cached:
+            elevations=self.elevationProvider.fetch(coords)
+            if progress!=None:
+                progress(elevations)
+            self.hikeData['alt']=self.fillElevations(elevations)
+            return
+
+        if self.elevationCache==None:
+            self.elevationCache=elevation.ElevationCache()
+
+        keys=self.elevationCache.keys(coords)
+        elevations,found=self.elevationCache.get(keys)
+
+        if progress!=None:
+            progress(elevations.copy())
+
+        #   only one request per uncached location (points within ~1 m of each other share one)
+        missing=np.flatnonzero(~found)
+        missingKeys,first,inverse=np.unique(keys[missing],return_index=True,return_inverse=True)
+        if len(missingKeys)!=0:
+            landed=None
+            if progress!=None:
+                fetched=np.full(len(missingKeys),np.nan)
+                last=[time.perf_counter()]
+                def landed(start,alts):
+                    fetched[start:start+len(alts)]=alts
+                    if time.perf_counter()-last[0]>=self.PROGRESS_INTERVAL:
+                        last[0]=time.perf_counter()
+                        partial=elevations.copy()
+                        partial[missing]=fetched[inverse]
+                        progress(partial)
+
+            fetched=self.fetchElevations(coords[missing[first]],missingKeys,landed)
+            elevations[missing]=fetched[inverse]
+
+        self.hikeData['alt']=self.fillElevations(elevations)
+
+        return
+
+    def fillElevations(self,elevations):
+        """Points without data take the previous altitude"""
+        return pd.Series(elevations).ffill().bfill().to_numpy()
+
+    @instrument.timed('path.fetchElevations')
+    def fetchElevations(self,coords,keys,landed=None):
+        """Gets altitudes from the elevation provider & stores them in the cache. landed(start,alts) is called as each chunk arrives. Returns nan where there is no data."""
+        from tqdm import tqdm
+
         print("Downloading elevation data...")
-        for chunk in tqdm(coordChunks):
-            params="locations="+"|".join(",".join(str(n) for n in pair) for pair in chunk)
-            response=requests.get(url+params)
-
-            results=response.json()['results']
-            for i,result in enumerate(results):
-                alt=result['elevation']
-                if alt!=None:
-                    elevations.append(float(result['elevation']))
-                else:
-                    elevations.append(elevations[i-1])
-                    
-            
-            time.sleep(0.34) #   3 calls per second max
-        elevations=np.array(elevations)
+        with tqdm(total=len(coords)) as progress:
+            def store(start,alts):
+                self.elevationCache.put(keys[start:start+len(alts)],alts)
+                progress.update(len(alts))
+                if landed!=None:
+                    landed(start,alts)
 
-        self.hikeData['alt']=elevations
+            elevations=self.elevationProvider.fetch(coords,callback=store)
+        print(f"{self.elevationProvider.stats['requests_per_second']:.2f} requests/s")
 
-        return
+        return elevations
 
+    @instrument.timed('path.calcDist')
     def calcDist(self):
         """Calculates distance between coordinates."""
-        dist=[] #   UNITS: km
-        distSum=[]
-        for i,row in self.hikeData.iterrows():
-            if i==0:
-                dist.append(0)
-                distSum.append(0)
-                continue
-
-            lat0=self.hikeData['lat_rad'][i-1]
-            lat1=self.hikeData['lat_rad'][i]
-            lon0=self.hikeData['lon_rad'][i-1]
-            lon1=self.hikeData['lon_rad'][i]
-
-            d=2*6371*np.arcsin(np.sqrt((np.sin((lat1-lat0)/2)**2+np.cos(lat0)*np.cos(lat1)*np.sin((lon1-lon0)/2)**2)))  #   equation from wikipedia somewhere
-            dist.append(float(d))
-            distSum.append(float(distSum[i-1]+d))
+        dist=route_engine.haversine(self.hikeData['lat_rad'].to_numpy(),self.hikeData['lon_rad'].to_numpy()) #   UNITS: km
+        distSum=route_engine.cumulative(dist)
 
         self.hikeData['dist']=dist
         self.hikeData['distSum']=distSum
 
-        self.distSum=distSum[-1]
+        self.distSum=float(distSum[-1])
 
         return
 
+    @instrument.timed('path.calcSlope')
     def calcSlope(self):
-        """Calculates slope between coordinates"""
-        slope=[]    #   UNITS: %
-        for i,row in self.hikeData.iterrows():
-            if i==0:
-                slope.append(0)
-                continue
-            
-            alt0=self.hikeData['alt'][i-1]
-            alt1=self.hikeData['alt'][i]
-            slope.append(float(100*(alt1-alt0)/(row['dist']*1600)))
-
-        self.hikeData['slope']=slope
+        """Calculates slope between coordinates, or over the smoothing window around each point if there is one."""
+        window=self.smoothingWindow()
+        alt=self.hikeData['alt'].to_numpy(dtype=float)
+        if window==None:
+            self.hikeData['slope']=route_engine.slope(alt,self.hikeData['dist'].to_numpy())  #   UNITS: %
+        else:
+            self.hikeData['slope']=route_engine.window_slope(alt,self.hikeData['distSum'].to_numpy(),window/1000)
 
-    def calcSpeed(self):
-        """Calculates walking speed according to slope."""
-        
+    def loadSpeedData(self):
+        """Reads speed model json."""
         with open(self.speed_file,'r') as f:
             speed_data=json.load(f)
-        
-        posGrad=speed_data["pos"] #   from linear curve fitted to strava data
-        negGrad=speed_data["neg"]
-        neutral=speed_data["neutral"] #   kph
-
-        speed=[]    #   UNITS: kph
-        for i,row in self.hikeData.iterrows():
-            if i==0:
-                speed.append(0)
-                continue
-
-            if row['slope']>0:
-                v=posGrad*row['slope']+neutral
-            else:
-                v=negGrad*row['slope']+neutral
-            if v<0.3:
-                v=0.3
-            
-            speed.append(float(v))
-        
-        #smoothes speed data
-        box_pts=8   #   colects 4 points to 1
-        box=np.ones(box_pts)/box_pts
-        speed_smooth=list(np.convolve(speed[1:],box,mode='same'))
-        speed_smooth[0]=speed[1]
-        speed_smooth[-1]=speed[-1]
+
+        return speed_data
+
+    def smoothingWindow(self,speed_data=None):
+        """Slope & speed smoothing window (m), from smoothWindow or the speed json. None if neither sets one."""
+        if self.smoothWindow!=None:
+            return self.smoothWindow
+        if speed_data==None:
+            speed_data=self.loadSpeedData()
+
+        return speed_data.get("window")
+
+    @instrument.timed('path.calcSpeed')
+    def calcSpeed(self):
+        """Calculates walking speed according to slope."""
+        speed_data=self.loadSpeedData()
+
+        if "curve" in speed_data:   #   binned curve from calibrate.py
+            curve=speed_data["curve"]
+            speed=route_engine.speed_curve(self.hikeData['slope'].to_numpy(),curve["slope"],curve["speed"])    #   UNITS: kph
+        else:
+            posGrad=speed_data["pos"] #   from linear curve fitted to strava data
+            negGrad=speed_data["neg"]
+            neutral=speed_data["neutral"] #   kph
+
+            speed=route_engine.speed(self.hikeData['slope'].to_numpy(),posGrad,negGrad,neutral)  #   UNITS: kph
 
         self.hikeData['speed']=speed
-        self.hikeData['speed_smooth']=[0]+speed_smooth
+        window=self.smoothingWindow(speed_data)
+        if window==None:
+            self.hikeData['speed_smooth']=route_engine.smooth(speed)
+        else:   #   distance weighted, so it doesn't depend on how densely the track is sampled
+            self.hikeData['speed_smooth']=route_engine.window_smooth(speed,self.hikeData['dist'].to_numpy(),window/1000)
 
+    @instrument.timed('path.calcTime')
     def calcTime(self):
         """Calculates walking time between coordinates"""
-        time=[]    #   UNITS: hrs
-        for i,row in self.hikeData.iterrows():
-            if i==0:
-                time.append(0)
-                continue
-                
-            time.append(float(row['dist']/row['speed']))
+        time=route_engine.segment_time(self.hikeData['dist'].to_numpy(),self.hikeData['speed'].to_numpy())  #   UNITS: hrs
         self.hikeData['time']=time
-        self.timeSum=sum(time[1:])
+        self.timeSum=float(route_engine.cumulative(time)[-1])
+
+    @instrument.timed('path.plotElevation')
+    def plotElevation(self,fig=None,dist=None,alt=None):
+        """Plots elevation. Returns matplotlib pyplot object.
+        fig is redrawn in place if given. dist & alt override hikeData['distSum'] & hikeData['alt'], e.g. with partially downloaded altitudes. Only what has been calculated so far is plotted.
+        Lines are decimated to the figure width & redecimated on zoom/pan, so drawing costs the same on any route length."""
+        from matplotlib import pyplot as plt
 
-    def plotElevation(self):
-        """Plots elevation. Returns matplotlib pyplot object."""
-        fig,ax=plt.subplots(figsize=(10,3))
-        ax.plot(self.hikeData['distSum'][1:],self.hikeData['alt'][1:],color='k',linewidth=1,label="Altitude")
+        if fig==None:
+            fig,ax=plt.subplots(figsize=(10,3))
+        else:
+            fig.clear()
+            ax=fig.add_subplot()
+        if dist is None and 'distSum' in self.hikeData:
+            dist=self.hikeData['distSum'].to_numpy()
+        if alt is None and 'alt' in self.hikeData:
+            alt=self.hikeData['alt'].to_numpy()
+
+        lines=[]
+        if dist is not None and alt is not None:
+            lines.append(profile_plot.DecimatedLine(ax,dist[1:],alt[1:],color='k',linewidth=1,label="Altitude"))
         ax.set_xlabel("Total Distance (km)")
         ax.set_ylabel("Altitude (m)")
 
         ax2=ax.twinx()
-        ax2.plot(self.hikeData['distSum'][1:],self.hikeData['speed_smooth'][1:],color='r',linewidth=1,label="Walking Speed")
+        if 'speed_smooth' in self.hikeData:
+            lines.append(profile_plot.DecimatedLine(ax2,self.hikeData['distSum'].to_numpy()[1:],self.hikeData['speed_smooth'].to_numpy()[1:],color='r',linewidth=1,label="Walking Speed"))
         ax2.set_ylabel("Speed (kph)")
+        profile_plot.follow(ax,lines)
 
         fig.tight_layout()
         ax2.yaxis.label.set_color('r')
 
-        #self.hikeData.to_csv('hike_data.csv')
-
         return fig
 
-    def coord_to_pixels(self,lat,lon,tile_size):
+    def coord_to_pixels(self,lat,lon,tile_size,zoom=None):
         """convert gps coordinates to web mercator"""
+        if zoom==None:
+            zoom=self.zoom
 
-        r = np.power(2, self.zoom) * tile_size
+        r = np.power(2, zoom) * tile_size
         lat = np.radians(lat)
 
         x = (lon + 180.0) / 360.0 * r  #   Equations in openstreetmap wiki
@@ -242,26 +356,60 @@ class Path():
 
         return x, y
 
+    def mapGeometry(self,zoom):
+        """Path bounding box in gps & map coordinates at zoom."""
+        #   min & max gps coordiantes & the route line, kept so background map builds don't read hikeData while it is being analysed
+        if self.bounds==None:
+            self.bounds=(self.hikeData['lat'].max(),self.hikeData['lat'].min(),self.hikeData['lon'].min(),self.hikeData['lon'].max())
+            segment=self.hikeData['segment'].to_numpy(copy=True) if 'segment' in self.hikeData else None
+            self.routeLine=(self.hikeData['lat'].to_numpy(copy=True),self.hikeData['lon'].to_numpy(copy=True),segment)
+        top,bot,left,right=self.bounds
+
+        #   min & max map coordinates - see openstreetmap wiki
+        x0,y1=self.coord_to_pixels(bot,left,self.TILE_SIZE,zoom)  #   y0,y1 flipped because latitude increases towards equator
+        x1,y0=self.coord_to_pixels(top,right,self.TILE_SIZE,zoom)
+
+        return {
+            'zoom':zoom,
+            'x0':x0,'y0':y0,'x1':x1,'y1':y1,
+            'left':left,'right':right,'bot':bot,'top':top,
+            'aspect_ratio':0.9*(x1-x0)/(y1-y0),
+        }
+
+    def setMapGeometry(self,geometry):
+        """Makes geometry the current map, used for plotting & canvas coordinates."""
+        self.zoom=geometry['zoom']
+        self.x0,self.y0,self.x1,self.y1=geometry['x0'],geometry['y0'],geometry['x1'],geometry['y1']
+        self.left,self.right,self.bot,self.top=geometry['left'],geometry['right'],geometry['bot'],geometry['top']
+        self.aspect_ratio=geometry['aspect_ratio']
+
     def getMap(self,tile_server,zoom=None):
-        """"Gets map tiles (see openstreetmap wiki) for path area."""
+        """"Gets map tiles (see openstreetmap wiki) for path area & makes it the current map."""
         if zoom==None:
-            self.zoom=self.DEFAULT_ZOOM
-        else:
-            self.zoom=zoom
+            zoom=self.DEFAULT_ZOOM
 
-        #   min & max gps coordiantes
-        top,bot=self.hikeData['lat'].max(),self.hikeData['lat'].min()
-        left,right=self.hikeData['lon'].min(),self.hikeData['lon'].max()
+        img,geometry=self.buildMap(tile_server,zoom)
+        self.setMapGeometry(geometry)
 
-        #   min & max map coordinates - see openstreetmap wiki
-        self.x0,self.y1=self.coord_to_pixels(bot,left,self.TILE_SIZE)  #   y0,y1 flipped because latitude increases towards equator
-        self.x1,self.y0=self.coord_to_pixels(top,right,self.TILE_SIZE)
+        return img
+
+    @instrument.timed('path.buildMap')
+    def buildMap(self,tile_server,zoom,verbose=True,progress=None):
+        """Stitches map tiles for path area at zoom. Leaves the current map alone, so it can run in the background. Returns (img, geometry).
+        progress(img,box,done,total) is called on this thread as tiles are pasted into the mosaic, which is cropped to box once complete; hold mapLock to read it.
+        With a mapCorridor, only tiles near the route are downloaded & the rest is filled from a lower zoom; geometry['tiles_skipped'] counts the tiles left out."""
+        from PIL import Image
+        from tqdm import tqdm
+        import tiles
+
+        geometry=self.mapGeometry(zoom)
+        x0,y0,x1,y1=geometry['x0'],geometry['y0'],geometry['x1'],geometry['y1']
 
         #   calcualtes tile dimensions
-        x0_tile=int(self.x0/self.TILE_SIZE)
-        y0_tile=int(self.y0/self.TILE_SIZE)
-        y1_tile=int(np.ceil(self.y1/self.TILE_SIZE))
-        x1_tile=int(np.ceil(self.x1/self.TILE_SIZE))
+        x0_tile=int(x0/self.TILE_SIZE)
+        y0_tile=int(y0/self.TILE_SIZE)
+        y1_tile=int(np.ceil(y1/self.TILE_SIZE))
+        x1_tile=int(np.ceil(x1/self.TILE_SIZE))
 
         #   Initiates image with size of tiles combined
         img=Image.new('RGB',(
@@ -269,48 +417,140 @@ class Path():
             abs(y1_tile-y0_tile)*self.TILE_SIZE
         ))
 
+        #   crop box of original min/max coordinates
+        x=x0_tile*self.TILE_SIZE
+        y=y0_tile*self.TILE_SIZE
+        box=(
+            int(x0-x),  #   left
+            int(y0-y),  #   top
+            int(x1-x),  #   right
+            int(y1-y)   #   bottom
+            )
+
         host=self.tileServers[tile_server]
+        servers=[host]+[server for server in self.tileServers if server!=host]
+
+        if self.tileCache==None:
+            self.tileCache=tiles.shared_cache()
+
+        wanted=[(x_tile,y_tile) for x_tile in range(x0_tile,x1_tile) for y_tile in range(y0_tile,y1_tile)]
+        geometry['tiles_skipped']=0
+        if self.mapCorridor!=None:
+            corridor=self.corridorTiles(zoom,(x0_tile,y0_tile,x1_tile,y1_tile))
+            geometry['tiles_skipped']=len(wanted)-len(corridor)
+            instrument.count('map.tiles_skipped',geometry['tiles_skipped'])
+            if verbose:
+                print(f"Map corridor: {len(corridor)} of {len(wanted)} tiles ({geometry['tiles_skipped']} skipped)")
+            if geometry['tiles_skipped']!=0:
+                self.fillBackground(img,servers,zoom,(x0_tile,y0_tile,x1_tile,y1_tile))
+            wanted=corridor
 
         tasks=[]
-        for x_tile in range(x0_tile,x1_tile):
-            for y_tile in range(y0_tile,y1_tile):
+        for x_tile,y_tile in wanted:
+            tile_img=self.tileCache.get(host,zoom,x_tile,y_tile)
+            if tile_img==None:
                 tasks.append((x_tile,y_tile))
-
-        #   Gets map tiles from api
-        print("Downloading map tiles...")
-        for task in tqdm(tasks):
-            x_tile,y_tile=task
-            try:
-                with requests.get("{host}/{z}/{x}/{y}.png".format(host=host,x=x_tile, y=y_tile, z=self.zoom)) as response:
-                    tile_img = Image.open(BytesIO(response.content))
-            except TimeoutError as error:
-                print(error)
-                print("\nMap tile server time out. Try another tile server: https://wiki.openstreetmap.org/wiki/Tiles")
-                exit()
-
-            #   stacks tiles
-            img.paste(
-                im=tile_img,
-                box=((x_tile-x0_tile)*self.TILE_SIZE,(y_tile-y0_tile)*self.TILE_SIZE)
-                )
+            else:
+                self.pasteTile(img,tile_img,x_tile-x0_tile,y_tile-y0_tile)
+        total=len(wanted)
+        if progress!=None:
+            progress(img,box,total-len(tasks),total)
+
+        #   Gets uncached map tiles from api, falling back to the other servers
+        if len(tasks)!=0:
+            if self.tileFetcher==None:
+                self.tileFetcher=tiles.TileFetcher()
+
+            if verbose:
+                print("Downloading map tiles...")
+            failed=[]
+            done=[total-len(tasks)]
+            with tqdm(total=len(tasks),disable=not verbose) as progress_bar:
+                def store(x_tile,y_tile,tile_host,data):
+                    progress_bar.update(1)
+                    done[0]+=1
+                    if tile_host==None:
+                        failed.append(data)
+                        return
+                    try:
+                        tile_img=self.tileCache.put(tile_host,zoom,x_tile,y_tile,data)
+                    except OSError as error:    #   not an image
+                        failed.append(error)
+                        return
+                    self.pasteTile(img,tile_img,x_tile-x0_tile,y_tile-y0_tile)
+                    if progress!=None:
+                        progress(img,box,done[0],total)
+
+                self.tileFetcher.fetch(servers,zoom,tasks,store)
+
+            if len(failed)!=0:  #   missing tiles are left blank
+                print(failed[-1])
+                print(f"\n{len(failed)} map tiles could not be downloaded (zoom {zoom}). Try another tile server: https://wiki.openstreetmap.org/wiki/Tiles")
 
         #   crops tiles to original min/max coordinates
-        x=x0_tile*self.TILE_SIZE
-        y=y0_tile*self.TILE_SIZE
-        img=img.crop((
-            int(self.x0-x),  #   left
-            int(self.y0-y),  #   top
-            int(self.x1-x),  #   right
-            int(self.y1-y)   #   bottom
-            ))
+        img=img.crop(box)
 
-        self.aspect_ratio=0.9*(self.x1-self.x0)/(self.y1-self.y0)
-        self.left,self.right,self.bot,self.top=left,right,bot,top
+        return img,geometry
 
-        return img
+    def corridorTiles(self,zoom,tile_box):
+        """[x,y] tiles within mapCorridor of the route at zoom, limited to tile_box (x0,y0,x1,y1 tiles, end exclusive)."""
+        lat,lon,segment=self.routeLine
+        x,y=self.coord_to_pixels(lat,lon,self.TILE_SIZE,zoom)
+        metres_per_pixel=2*np.pi*route_engine.EARTH_RADIUS*1000*np.cos(np.radians(np.mean(self.bounds[:2])))/(self.TILE_SIZE*2**zoom)
+        found=route_engine.corridor_tiles(x,y,self.TILE_SIZE,self.mapCorridor/metres_per_pixel,segment)
+
+        x0_tile,y0_tile,x1_tile,y1_tile=tile_box
+        inside=(found[:,0]>=x0_tile)&(found[:,0]<x1_tile)&(found[:,1]>=y0_tile)&(found[:,1]<y1_tile)
+
+        return [(int(x_tile),int(y_tile)) for x_tile,y_tile in found[inside]]
+
+    def fillBackground(self,img,servers,zoom,tile_box):
+        """Pastes upscaled tiles from CORRIDOR_FILL_LEVELS zooms lower under the whole mosaic, so areas outside the corridor aren't blank. Tiles that fail are left blank."""
+        import tiles
+
+        levels=min(self.CORRIDOR_FILL_LEVELS,zoom)
+        if levels==0:
+            return
+        scale=2**levels
+        x0_tile,y0_tile,x1_tile,y1_tile=tile_box
+        host=servers[0]
+
+        def paste(x_tile,y_tile,tile_img):
+            size=self.TILE_SIZE*scale
+            self.pasteTile(img,tile_img.resize((size,size)),x_tile*scale-x0_tile,y_tile*scale-y0_tile)
+
+        tasks=[]
+        for x_tile in range(x0_tile//scale,-(-x1_tile//scale)):
+            for y_tile in range(y0_tile//scale,-(-y1_tile//scale)):
+                tile_img=self.tileCache.get(host,zoom-levels,x_tile,y_tile)
+                if tile_img==None:
+                    tasks.append((x_tile,y_tile))
+                else:
+                    paste(x_tile,y_tile,tile_img)
+        if len(tasks)==0:
+            return
+
+        def store(x_tile,y_tile,tile_host,data):
+            if tile_host==None:
+                return
+            try:
+                paste(x_tile,y_tile,self.tileCache.put(tile_host,zoom-levels,x_tile,y_tile,data))
+            except OSError: #   not an image
+                pass
+
+        if self.tileFetcher==None:
+            self.tileFetcher=tiles.TileFetcher()
+        self.tileFetcher.fetch(servers,zoom-levels,tasks,store)
+
+    def pasteTile(self,img,tile_img,col,row):
+        """Stacks a tile into the map mosaic at tile column/row."""
+        with self.mapLock:
+            img.paste(im=tile_img,box=(col*self.TILE_SIZE,row*self.TILE_SIZE))
+        instrument.count('map.tiles_stitched')
 
     def plotMap(self,img):
         """Plots map tiles & path."""
+        from matplotlib import pyplot as plt
 
         fig,ax=plt.subplots()
         ax.imshow(img,extent=(self.left,self.right,self.bot,self.top))
@@ -322,10 +562,23 @@ class Path():
 
         return plt
 
+    @instrument.timed('path.splitDays')
+    def splitDays(self,days=None,target_hours=None,rest_km=0,rest_lunch=0):
+        """Fills the 'day' column by splitting the route into days of even duration, rest included (rest_km: mins per km, rest_lunch: mins per day).
+        Give the number of days, or target_hours for the fewest days no longer than that. Returns the day of every point."""
+        cost=self.hikeData['time'].to_numpy()+self.hikeData['dist'].to_numpy()*rest_km/60
+        day=route_engine.split_days(cost,days,target_hours,rest_lunch/60)
+        self.hikeData['day']=pd.array(day,dtype='Int64')
+
+        return day
+
+    @instrument.timed('path.calcDayData')
     def calcDayData(self):
-        """Calculates distance and time of each day. Requires 'day' data in hikeData."""
+        """Calculates distance, time, ascent & descent of each day from the route index. Requires 'day' data in hikeData."""
+        labels=pd.to_numeric(self.hikeData['day']).to_numpy(dtype=float,na_value=np.nan)
+        days,totals=self.index.labelled(labels)
 
-        day_data=self.hikeData.dropna(subset=['day'])
-        day_data=day_data.groupby(by=['day'],as_index=False).sum()[['day','dist','time']]
+        day_data=pd.DataFrame(data=totals)
+        day_data.insert(0,'day',days.astype(int))
 
         return day_data
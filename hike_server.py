@@ -0,0 +1,375 @@
+import os
+import math
+import json
+import base64
+import signal
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+from argparse import ArgumentParser
+import numpy as np
+
+import hike_batch
+import hike_data_processor
+import elevation
+import route_engine
+import snapshot
+
+FORMATS=('gpx','kml','kmz')
+PROFILE_POINTS=500  #   pixel columns the returned profile is decimated to (up to 4 points each)
+MAX_BODY=64*2**20   #   bytes
+KEY_LENGTH=16   #   hex digits of the sha256 naming stored routes, speed models & results
+MAP_ZOOMS=range(10,17)  #   as the GUI's zoom slider (Paint.ZOOMS). Higher zooms of a long route mean huge mosaics & thousands of tiles from public servers
+STORE_SIZE=1024 #   MB, default cap on each of the stored routes & maps
+
+#   request options: type, default
+OPTIONS={
+    'days':(int,None),
+    'target_hours':(float,None),
+    'rest_km':(float,10.0),
+    'rest_lunch':(float,60.0),
+    'simplify':(float,0.0),
+    'smooth_window':(float,None),
+    'profile_points':(int,PROFILE_POINTS),
+    'map_zoom':(int,None),
+    'map_corridor':(float,None),
+    'tile_server':(int,2),
+}
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()[:KEY_LENGTH]
+
+def jsonList(values):
+    """Array as a json-able list, nan as null."""
+    values=np.asarray(values,dtype=float)
+
+    return [None if np.isnan(value) else value for value in values.tolist()]
+
+def number(name,kind,value):
+    """Request option as kind. Raises ValueError unless it is a json number (a whole one for int), not a bool, string, list or object."""
+    if isinstance(value,bool) or not isinstance(value,(int,float)) or not math.isfinite(value) or (kind==int and value!=int(value)):
+        raise ValueError(f"{name} must be {'an integer' if kind==int else 'a number'}")
+
+    return kind(value)
+
+class DiskBudget():
+    """Files in a directory, the least recently used deleted once they total more than max_bytes.
+    Sizes are read once at startup & kept up to date as files are used, so nothing is rescanned per request."""
+
+    def __init__(self,directory,max_bytes):
+        self.directory=directory
+        self.max_bytes=max_bytes
+        self.lock=threading.Lock()
+        self.files=OrderedDict()    #   name: bytes, least recently used first
+        entries=[entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.endswith('.tmp')]
+        for entry in sorted(entries,key=lambda entry: entry.stat().st_mtime):
+            self.files[entry.name]=entry.stat().st_size
+        self.bytes=sum(self.files.values())
+
+    def use(self,file):
+        """Records that file was added or reused & deletes the least recently used others over budget."""
+        name=os.path.basename(file)
+        with self.lock:
+            self.bytes-=self.files.pop(name,0)
+            try:
+                size=os.path.getsize(file)
+            except OSError:
+                return
+            self.files[name]=size
+            self.bytes+=size
+            while self.bytes>self.max_bytes and len(self.files)>1:
+                stale,size=self.files.popitem(last=False)
+                self.bytes-=size
+                try:
+                    os.remove(os.path.join(self.directory,stale))
+                except FileNotFoundError:
+                    pass
+
+def storeFile(directory,data,extension):
+    """Writes data to a file named by its hash, unless it is already there. Returns the path."""
+    file=os.path.join(directory,digest(data)+extension)
+    if not os.path.isfile(file):
+        tmp=f'{file}.{threading.get_ident()}.tmp'
+        with open(tmp,'wb') as f:
+            f.write(data)
+        os.replace(tmp,file)
+
+    return file
+
+def planRoute(gps_file,speed_file,params,map_file):
+    """Runs the Path pipeline for one request on a worker process (see hike_batch.initWorker). Returns the json-able result.
+    Analysed routes are kept as snapshots per route & analysis settings, so repeated requests only redo the day split & profile."""
+    worker=hike_batch.worker
+    options=worker['options']
+    t0=time.perf_counter()
+
+    analysis=digest(json.dumps([snapshot.checksum(speed_file),params['simplify'],params['smooth_window']]).encode())
+    snapshot_file=os.path.join(options['cache_dir'],'snapshots',f"{os.path.splitext(os.path.basename(gps_file))[0]}-{analysis}{snapshot.EXTENSION}")
+    path=hike_data_processor.Path(gps_file,speed_file,
+                                elevation_cache=worker['elevation_cache'],
+                                elevation_provider=worker['elevation_provider'],
+                                snapshot_file=snapshot_file,
+                                simplify_tolerance=params['simplify'],
+                                map_corridor=params['map_corridor'],
+                                smooth_window=params['smooth_window'])
+    loaded=path.analysed
+    path.analyse()
+    if not loaded:
+        path.saveSnapshot()
+
+    data=path.hikeData
+    totals=path.between(0,len(data)-1)
+    dist=data['distSum'].to_numpy()
+    keep=route_engine.decimate(dist,data['alt'].to_numpy(dtype=float),params['profile_points'])
+    result={
+        'name':path.name,
+        'points':len(data),
+        'segments':int(data['segment'].max())+1 if 'segment' in data and len(data)!=0 else 1,
+        'distance_km':path.distSum,
+        'time_hrs':path.timeSum,
+        'ascent_m':float(totals['ascent']),
+        'descent_m':float(totals['descent']),
+        'profile':{
+            'dist':jsonList(dist[keep]),
+            'alt':jsonList(data['alt'].to_numpy(dtype=float)[keep]),
+            'speed':jsonList(data['speed_smooth'].to_numpy()[keep]),
+        },
+        'days':None,
+        'map':None,
+        'snapshot':loaded,
+    }
+
+    if params['days']!=None or params['target_hours']!=None:
+        path.splitDays(params['days'],params['target_hours'],params['rest_km'],params['rest_lunch'])
+        day_data=path.calcDayData()
+        hours=day_data['time']+day_data['dist']*params['rest_km']/60+params['rest_lunch']/60
+        result['days']=[{'day':int(row['day'])+1,'distance_km':float(row['dist']),'time_hrs':float(row['time']),'hours_with_rest':float(hrs),
+                        'ascent_m':float(row['ascent']),'descent_m':float(row['descent'])} for (_,row),hrs in zip(day_data.iterrows(),hours)]
+
+    if map_file!=None:
+        if not os.path.isfile(map_file):
+            img,_=path.buildMap(params['tile_server'],params['map_zoom'],verbose=False)
+            tmp=f'{map_file}.{os.getpid()}.tmp'
+            img.save(tmp,format='PNG')
+            os.replace(tmp,map_file)
+        result['map']='/maps/'+os.path.basename(map_file)
+
+    result['seconds']=time.perf_counter()-t0
+
+    return result
+
+class PlanningService():
+    """Runs plan requests on a process pool whose workers share the elevation & tile caches (sqlite) and route snapshots.
+    Identical requests in flight at the same time are computed once & the result given to all of them."""
+
+    def __init__(self,cache_dir,workers,speed_models=None,dem=None,elevation_cache_size=elevation.ElevationCache.DEFAULT_MAX_ENTRIES,store_size=STORE_SIZE):
+        self.cache_dir=cache_dir
+        self.speed_models=speed_models or {}    #   name: speed json file, usable by name in requests
+        self.directory=os.path.join(cache_dir,'server')
+        for sub in ('routes','speed','maps'):
+            os.makedirs(os.path.join(self.directory,sub),exist_ok=True)
+        self.routes=DiskBudget(os.path.join(self.directory,'routes'),store_size*2**20)
+        self.maps=DiskBudget(os.path.join(self.directory,'maps'),store_size*2**20)
+
+        options={
+            'cache_dir':cache_dir,
+            'elevation_cache_size':elevation_cache_size,
+            'dem':dem,
+            'workers':workers,
+            'maps':True,
+            'report':False,
+        }
+        self.pool=ProcessPoolExecutor(max_workers=workers,initializer=hike_batch.initWorker,initargs=(options,))
+        self.workers=workers
+
+        self.lock=threading.Lock()
+        self.inFlight={}
+        self.stats={'requests':0,'computed':0,'deduplicated':0,'failed':0}
+
+    def parse(self,request):
+        """Checks a plan request & stores its route & speed model. Returns (gps_file, speed_file, params, map_file). Raises ValueError if it is invalid."""
+        if not isinstance(request,dict):
+            raise ValueError("Request must be a json object")
+
+        fmt=request.get('format','gpx')
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        if 'route_base64' in request:
+            if not isinstance(request['route_base64'],str):
+                raise ValueError("route_base64 must be a string")
+            route=base64.b64decode(request['route_base64'],validate=True)
+        elif 'route' in request:
+            if not isinstance(request['route'],str):
+                raise ValueError("route must be the route file's text")
+            route=request['route'].encode()
+        else:
+            raise ValueError("Request needs the route file as 'route' (text) or 'route_base64'")
+
+        speed=request.get('speed')
+        if isinstance(speed,str):
+            if speed not in self.speed_models:
+                raise ValueError(f"Unknown speed model '{speed}'. Available: {', '.join(self.speed_models) or 'none'}")
+            speed_file=self.speed_models[speed]
+        elif isinstance(speed,dict):
+            if not all(key in speed for key in ('pos','neg','neutral')):
+                raise ValueError("Speed model needs 'pos', 'neg' & 'neutral'")
+            for key in ('pos','neg','neutral','window'):
+                if key in speed and speed[key]!=None:
+                    number(f'speed {key}',float,speed[key])
+            speed_file=storeFile(os.path.join(self.directory,'speed'),json.dumps(speed,sort_keys=True).encode(),'.json')
+        else:
+            raise ValueError("Request needs a speed model: a name or a speed json object")
+
+        params={}
+        for name,(kind,default) in OPTIONS.items():
+            value=request.get(name,default)
+            params[name]=None if value==None else number(name,kind,value)
+        if params['map_zoom']!=None and params['map_zoom'] not in MAP_ZOOMS:
+            raise ValueError(f"map_zoom must be from {MAP_ZOOMS[0]} to {MAP_ZOOMS[-1]}")
+        if not 0<=params['tile_server']<len(hike_data_processor.Path.tileServers):
+            raise ValueError(f"tile_server must be from 0 to {len(hike_data_processor.Path.tileServers)-1}")
+
+        gps_file=storeFile(os.path.join(self.directory,'routes'),route,'.'+fmt)
+        map_file=None
+        if params['map_zoom']!=None:
+            key=digest(json.dumps([gps_file,params['map_zoom'],params['map_corridor'],params['tile_server']]).encode())
+            map_file=os.path.join(self.directory,'maps',key+'.png')
+
+        return gps_file,speed_file,params,map_file
+
+    def plan(self,request):
+        """Result of a plan request, waiting for an identical one already running if there is one."""
+        gps_file,speed_file,params,map_file=self.parse(request)
+        self.routes.use(gps_file)
+        key=json.dumps([gps_file,speed_file,params],sort_keys=True)
+
+        with self.lock:
+            self.stats['requests']+=1
+            future=self.inFlight.get(key)
+            if future==None:
+                self.stats['computed']+=1
+                future=self.pool.submit(planRoute,gps_file,speed_file,params,map_file)
+                self.inFlight[key]=future
+                future.add_done_callback(lambda future: self.finished(key))
+            else:
+                self.stats['deduplicated']+=1
+
+        try:
+            result=future.result()
+        except Exception:
+            with self.lock:
+                self.stats['failed']+=1
+            raise
+        if map_file!=None:
+            self.maps.use(map_file)
+
+        return result
+
+    def finished(self,key):
+        with self.lock:
+            self.inFlight.pop(key,None)
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats,in_flight=len(self.inFlight),workers=self.workers,speed_models=sorted(self.speed_models))
+
+    def close(self):
+        self.pool.shutdown()
+
+class PlanningHandler(BaseHTTPRequestHandler):
+    """POST /plan (json request, see README), GET /maps/<file>.png & GET /health."""
+    service=None
+    quiet=False
+
+    def do_POST(self):
+        if urlparse(self.path).path!='/plan':
+            self.sendJson(404,{'error':'Not found'})
+            return
+
+        length=int(self.headers.get('Content-Length',0))
+        if length>MAX_BODY:
+            self.sendJson(413,{'error':f'Request larger than {MAX_BODY} bytes'})
+            return
+        try:
+            request=json.loads(self.rfile.read(length))
+            result=self.service.plan(request)
+        except (ValueError,UnicodeDecodeError) as error:    #   bad json, base64 or options
+            self.sendJson(400,{'error':str(error)})
+        except Exception as error:  #   route couldn't be analysed
+            self.sendJson(500,{'error':f"{type(error).__name__}: {error}"})
+        else:
+            self.sendJson(200,result)
+
+    def do_GET(self):
+        url=urlparse(self.path).path
+        if url=='/health':
+            self.sendJson(200,dict(self.service.status(),status='ok'))
+            return
+
+        name=url[len('/maps/'):]
+        file=os.path.join(self.service.directory,'maps',name)
+        if not url.startswith('/maps/') or os.path.basename(name)!=name or not os.path.isfile(file):
+            self.sendJson(404,{'error':'Not found'})
+            return
+        with open(file,'rb') as f:
+            self.send(200,f.read(),'image/png')
+
+    def sendJson(self,code,data):
+        self.send(code,json.dumps(data).encode(),'application/json')
+
+    def send(self,code,body,content_type):
+        self.send_response(code)
+        self.send_header('Content-Type',content_type)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,*args):
+        if not self.quiet:
+            super().log_message(*args)
+
+def stop(signum,frame):
+    raise KeyboardInterrupt
+
+def serve(service,host,port,quiet=False):
+    """Blocks serving requests until interrupted (Ctrl+C or SIGTERM), then shuts down the workers."""
+    signal.signal(signal.SIGTERM,stop)
+    PlanningHandler.service=service
+    PlanningHandler.quiet=quiet
+    server=ThreadingHTTPServer((host,port),PlanningHandler)
+    server.daemon_threads=True
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]} with {service.workers} workers", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Local planning service: analyses routes posted over http on a pool of workers sharing the elevation & tile caches.')
+    parser.add_argument('--host',default='127.0.0.1',help='Address to listen on. 0.0.0.0 serves the whole network.')
+    parser.add_argument('--port',type=int,default=8080)
+    parser.add_argument('-j','--workers',type=int,default=os.cpu_count(),help='Number of processes.')
+    parser.add_argument('--speed-model',nargs='+',default=[],metavar='NAME=FILE',help='Speed models (.json) requests can refer to by name, e.g. hike=hike.json.')
+    parser.add_argument('--cache-dir',default=elevation.DEFAULT_CACHE_DIR,help='Directory for the elevation & map tile caches, route snapshots and stored requests.')
+    parser.add_argument('--elevation-cache-size',type=int,default=elevation.ElevationCache.DEFAULT_MAX_ENTRIES,help='Max. number of cached elevation points.')
+    parser.add_argument('--dem',nargs='+',help='Local DEM rasters or directories (.npy + .json sidecar, GeoTIFF) used instead of opentopodata.')
+    parser.add_argument('--store-size',type=int,default=STORE_SIZE,help='Max. size (MB) of the posted routes, and separately of the rendered maps, kept on disk.')
+    parser.add_argument('--quiet',action='store_true',help="Don't log every request.")
+    args=parser.parse_args()
+
+    speed_models={}
+    for model in args.speed_model:
+        name,_,file=model.partition('=')
+        if file=='':    #   just a file, named after it
+            name,file=os.path.splitext(os.path.basename(model))[0],model
+        speed_models[name]=os.path.abspath(file)
+
+    service=PlanningService(args.cache_dir,args.workers,speed_models,args.dem,args.elevation_cache_size,args.store_size)
+    serve(service,args.host,args.port,args.quiet)
@@ -0,0 +1,162 @@
+import atexit
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import nullcontext
+
+NULL_STAGE=nullcontext()    #   returned while disabled, so a stage costs one attribute check
+
+class Stage():
+    """Times one pass through a named stage."""
+    __slots__=('recorder','name','t0')
+
+    def __init__(self,recorder,name):
+        self.recorder=recorder
+        self.name=name
+
+    def __enter__(self):
+        self.t0=time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        self.recorder.add(self.name,time.perf_counter()-self.t0)
+
+class Recorder():
+    """Wall time of named stages & event counters (points, api calls, bytes, cache hits...). Nothing is recorded until enabled.
+    Stages nest, so a stage's time includes the stages called inside it. Safe to use from background threads."""
+
+    def __init__(self):
+        self.enabled=False
+        self.profiler=None
+        self.lock=threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages={}
+            self.counters={}
+            self.started=time.perf_counter()
+
+    def enable(self,profile=False):
+        """Starts recording. profile also runs cProfile on the calling thread."""
+        self.enabled=True
+        if profile and self.profiler==None:
+            self.profiler=cProfile.Profile()
+            self.profiler.enable()
+
+    def disable(self):
+        self.enabled=False
+        if self.profiler!=None:
+            self.profiler.disable()
+
+    def stage(self,name):
+        """Context manager timing a stage: with recorder.stage('path.calcDist'): ..."""
+        if not self.enabled:
+            return NULL_STAGE
+
+        return Stage(self,name)
+
+    def add(self,name,seconds):
+        with self.lock:
+            stage=self.stages.get(name)
+            if stage==None:
+                stage=self.stages[name]={'calls':0,'seconds':0.0,'max':0.0}
+            stage['calls']+=1
+            stage['seconds']+=seconds
+            stage['max']=max(stage['max'],seconds)
+
+    def count(self,name,n=1):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[name]=self.counters.get(name,0)+n
+
+    def report(self,top=30):
+        """Json-able summary. Includes the top cumulative-time functions if profiling."""
+        with self.lock:
+            stages={name:dict(stage,mean=stage['seconds']/stage['calls']) for name,stage in sorted(self.stages.items())}
+            report={'wall_seconds':time.perf_counter()-self.started,'stages':stages,'counters':dict(sorted(self.counters.items()))}
+
+        if self.profiler!=None:
+            self.profiler.disable()
+            stream=io.StringIO()
+            pstats.Stats(self.profiler,stream=stream).sort_stats('cumulative').print_stats(top)
+            report['profile']=stream.getvalue()
+            if self.enabled:
+                self.profiler.enable()
+
+        return report
+
+    def dump(self,file=None):
+        dump(self.report(),file)
+
+def dump(report,file=None):
+    """Writes a report to a json file, or prints it if file is None."""
+    if file!=None:
+        with open(file,'w') as f:
+            json.dump(report,f,indent=4)
+        return
+
+    print(f"\n--- {report['wall_seconds']:.2f} s ---")
+    print(f"{'stage':<32}{'calls':>8}{'total s':>12}{'mean s':>12}{'max s':>12}")
+    for name,stage in report['stages'].items():
+        print(f"{name:<32}{stage['calls']:>8}{stage['seconds']:>12.4f}{stage['mean']:>12.4f}{stage['max']:>12.4f}")
+    for name,value in report['counters'].items():
+        print(f"{name:<32}{value:>8}")
+    if 'profile' in report:
+        print(report['profile'])
+
+def merge(reports,wall_seconds=None):
+    """Combines reports from several processes: stage times & counters are summed.
+    wall_seconds is the elapsed time of the whole run; without it, that of the longest report is used."""
+    merged={'wall_seconds':0.0,'stages':{},'counters':{}}
+    for report in reports:
+        merged['wall_seconds']=max(merged['wall_seconds'],report['wall_seconds'])
+        for name,stage in report['stages'].items():
+            total=merged['stages'].setdefault(name,{'calls':0,'seconds':0.0,'max':0.0})
+            total['calls']+=stage['calls']
+            total['seconds']+=stage['seconds']
+            total['max']=max(total['max'],stage['max'])
+        for name,value in report['counters'].items():
+            merged['counters'][name]=merged['counters'].get(name,0)+value
+    for stage in merged['stages'].values():
+        stage['mean']=stage['seconds']/stage['calls']
+    merged['stages']=dict(sorted(merged['stages'].items()))
+    merged['counters']=dict(sorted(merged['counters'].items()))
+    if wall_seconds!=None:
+        merged['wall_seconds']=wall_seconds
+
+    return merged
+
+#   shared by Path, Paint, the elevation & tile fetchers
+recorder=Recorder()
+
+def stage(name):
+    return recorder.stage(name)
+
+def count(name,n=1):
+    recorder.count(name,n)
+
+def timed(name):
+    """Decorator timing every call of a function as a stage."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            if not recorder.enabled:
+                return function(*args,**kwargs)
+            with Stage(recorder,name):
+                return function(*args,**kwargs)
+
+        return wrapper
+
+    return decorate
+
+def reportAtExit(file=None,profile=False):
+    """Enables recording & dumps the report (json file, or printed) when the program exits."""
+    recorder.enable(profile)
+    atexit.register(recorder.dump,file)
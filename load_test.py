@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
+from argparse import ArgumentParser
+import numpy as np
+
+import synthetic
+
+DEM_STEP=0.0005 #   degrees, grid spacing of the synthetic DEM (~50 m)
+STARTUP=60  #   s, max. wait for the service to come up
+TIMEOUT=600 #   s, per request
+
+def writeDem(directory):
+    """Synthetic DEM (.npy + sidecar) covering the synthetic routes, so the service needs no elevation api."""
+    top=synthetic.CENTRE[0]+synthetic.EXTENT
+    left=synthetic.CENTRE[1]-synthetic.EXTENT
+    n=int(2*synthetic.EXTENT/DEM_STEP)+2
+    lat=top-np.arange(n)*DEM_STEP
+    lon=left+np.arange(n)*DEM_STEP
+    file=os.path.join(directory,'dem.npy')
+    np.save(file,synthetic.syntheticAltitude(lat[:,None],lon[None,:]))
+    with open(os.path.join(directory,'dem.json'),'w') as f:
+        json.dump({'top':top,'left':left,'dlat':DEM_STEP,'dlon':DEM_STEP},f)
+
+    return file
+
+def writeRoutes(directory,routes,points):
+    """Distinct synthetic routes. Returns their gpx text."""
+    texts=[]
+    for seed in range(routes):
+        file=os.path.join(directory,f'route_{seed}.gpx')
+        synthetic.writeGpx(file,*synthetic.syntheticRoute(points,seed))
+        with open(file,'r') as f:
+            texts.append(f.read())
+
+    return texts
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1',0))
+        return s.getsockname()[1]
+
+def get(url):
+    with urlopen(url,timeout=TIMEOUT) as response:
+        return json.loads(response.read())
+
+def post(url,body):
+    """Returns (seconds, error or None)."""
+    t0=time.perf_counter()
+    try:
+        with urlopen(Request(url,data=json.dumps(body).encode(),headers={'Content-Type':'application/json'}),timeout=TIMEOUT) as response:
+            response.read()
+    except HTTPError as error:
+        return time.perf_counter()-t0,f"{error.code}: {error.read().decode(errors='replace')}"
+
+    return time.perf_counter()-t0,None
+
+def phase(url,name,bodies,clients):
+    """Posts every request body from clients concurrent connections. Returns the phase's throughput & latencies."""
+    before=get(url+'/health')
+    t0=time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results=list(pool.map(lambda body: post(url+'/plan',body),bodies))
+    seconds=time.perf_counter()-t0
+    after=get(url+'/health')
+
+    latency=np.array([result[0] for result in results])
+    errors=[result[1] for result in results if result[1]!=None]
+    if len(errors)!=0:
+        print(f"{name}: {len(errors)} failed, e.g. {errors[0]}")
+
+    return {
+        'phase':name,
+        'requests':len(bodies),
+        'clients':clients,
+        'failed':len(errors),
+        'seconds':seconds,
+        'requests_per_second':len(bodies)/seconds,
+        'p50_s':float(np.percentile(latency,50)),
+        'p95_s':float(np.percentile(latency,95)),
+        'computed':after['computed']-before['computed'],
+        'deduplicated':after['deduplicated']-before['deduplicated'],
+    }
+
+def run(args,workdir):
+    dem=writeDem(workdir)
+    routes=writeRoutes(workdir,args.routes,args.points)
+    port=freePort()
+    url=f'http://127.0.0.1:{port}'
+
+    command=[sys.executable,os.path.join(os.path.dirname(os.path.abspath(__file__)),'hike_server.py'),
+            '--port',str(port),'-j',str(args.workers),'--dem',dem,'--cache-dir',os.path.join(workdir,'cache'),
+            '--speed-model',f'model={os.path.abspath(args.speed_data)}','--quiet']
+    server=subprocess.Popen(command,stdout=subprocess.DEVNULL)
+    try:
+        deadline=time.perf_counter()+STARTUP
+        while True:
+            try:
+                get(url+'/health')
+                break
+            except (URLError,ConnectionError):
+                if time.perf_counter()>deadline or server.poll()!=None:
+                    raise RuntimeError("Planning service didn't start")
+                time.sleep(0.2)
+
+        def body(route,**options):
+            return dict({'route':routes[route],'speed':'model','days':3},**options)
+
+        results=[
+            #   every route analysed from scratch: elevations, speeds & snapshot written
+            phase(url,'cold',[body(i) for i in range(args.routes)],args.clients),
+            #   repeated routes with varying day splits, answered from the snapshots
+            phase(url,'warm',[body(i%args.routes,days=1+i%5) for i in range(args.requests)],args.clients),
+            #   every client asks for the same new analysis at once, which is computed once
+            phase(url,'burst',[body(0,smooth_window=100)]*args.clients,args.clients),
+        ]
+    finally:
+        server.terminate()
+        server.wait()
+
+    return results
+
+if __name__ == '__main__':
+    parser=ArgumentParser(description='Load test for hike_server.py: starts the service on synthetic routes & a local DEM and measures requests/second.')
+    parser.add_argument('--speed-data',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'hike.json'),help='Speed (kph) against gradient data (.json)')
+    parser.add_argument('--routes',type=int,default=16,help='Number of distinct routes.')
+    parser.add_argument('--points',type=int,default=10000,help='Points per route.')
+    parser.add_argument('--requests',type=int,default=400,help='Requests in the warm phase.')
+    parser.add_argument('--clients',type=int,default=16,help='Concurrent connections.')
+    parser.add_argument('-j','--workers',type=int,default=os.cpu_count(),help='Service worker processes.')
+    parser.add_argument('-o','--output',help='Write the results to a json file.')
+    args=parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results=run(args,workdir)
+
+    print(f"{'phase':<8}{'requests':>10}{'failed':>8}{'req/s':>10}{'p50 s':>10}{'p95 s':>10}{'computed':>10}{'deduped':>10}")
+    for result in results:
+        print(f"{result['phase']:<8}{result['requests']:>10}{result['failed']:>8}{result['requests_per_second']:>10.1f}{result['p50_s']:>10.3f}{result['p95_s']:>10.3f}{result['computed']:>10}{result['deduplicated']:>10}")
+    if args.output!=None:
+        with open(args.output,'w') as f:
+            json.dump({'settings':vars(args),'results':results},f,indent=4)
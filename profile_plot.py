@@ -0,0 +1,26 @@
+import numpy as np
+
+import route_engine
+
+class DecimatedLine():
+    """Matplotlib line drawing only the points visible at the axes' pixel width (see route_engine.decimate). Redecimated by follow() whenever the distance axis is zoomed or panned."""
+
+    def __init__(self,ax,x,y,**kwargs):
+        self.x=np.asarray(x,dtype=float)
+        self.y=np.asarray(y,dtype=float)
+        self.line,=ax.plot([],[],**kwargs)
+
+        self.update(ax,full=True)
+        ax.relim()
+        ax.autoscale_view()
+
+    def update(self,ax,full=False):
+        width=max(int(ax.bbox.width),1)
+        lo,hi=(None,None) if full else ax.get_xlim()
+        keep=route_engine.decimate(self.x,self.y,width,lo,hi)
+        self.line.set_data(self.x[keep],self.y[keep])
+
+def follow(ax,lines):
+    """Redecimates lines (on ax or its twinx siblings) whenever ax's distance axis is zoomed or panned.
+    One callback on the primary axes, since older matplotlib sets a twin's shared limits without emitting its xlim_changed."""
+    ax.callbacks.connect('xlim_changed',lambda ax: [line.update(ax) for line in lines])    #   the lambda keeps the lines alive with the axes
@@ -0,0 +1,360 @@
+import numpy as np
+
+EARTH_RADIUS=6371   #   UNITS: km
+MIN_SPEED=0.3   #   kph
+BOX_PTS=8   #   speed smoothing window (points)
+MAX_SIMPLIFY_ERROR=0.01 #   max. relative change in total distance allowed by simplify()
+SIMPLIFY_NOISE=2    #   m, gps jitter. simplify() measures distance against the track simplified this far, as jitter inflates the raw distance
+SIMPLIFY_STEPS=4    #   tolerances simplify() tries per doubling above SIMPLIFY_NOISE
+
+def haversine(lat_rad,lon_rad):
+    """Distance between consecutive coordinates (radians). First element is 0. UNITS: km"""
+    dist=np.zeros(len(lat_rad))
+    if len(lat_rad)<2:
+        return dist
+
+    lat0,lat1=lat_rad[:-1],lat_rad[1:]
+    lon0,lon1=lon_rad[:-1],lon_rad[1:]
+    dist[1:]=2*EARTH_RADIUS*np.arcsin(np.sqrt((np.sin((lat1-lat0)/2)**2+np.cos(lat0)*np.cos(lat1)*np.sin((lon1-lon0)/2)**2)))
+
+    return dist
+
+def cumulative(values):
+    """Running total, summed in order so totals match a python loop exactly."""
+    return np.cumsum(values)
+
+def slope(alt,dist):
+    """Slope between consecutive points. First element is 0. UNITS: %"""
+    grade=np.zeros(len(alt))
+    with np.errstate(divide='ignore',invalid='ignore'):   #   repeated points give inf/nan, as before
+        grade[1:]=100*(alt[1:]-alt[:-1])/(dist[1:]*1600)
+
+    return grade
+
+def window_bounds(distSum,window):
+    """First & last point within window/2 (km) either side of each point, by binary search on distSum. The first bound is at least the previous point, so every window has a segment."""
+    i=np.arange(len(distSum))
+    lo=np.searchsorted(distSum,distSum-window/2,side='left')
+    hi=np.searchsorted(distSum,distSum+window/2,side='right')-1
+
+    return np.clip(np.minimum(lo,i-1),0,None),np.maximum(hi,i)
+
+def window_slope(alt,distSum,window):
+    """Slope over a distance window (km) centred on each point, so it doesn't depend on how densely the track is sampled. First element is 0. UNITS: as slope()"""
+    grade=np.zeros(len(alt))
+    if len(alt)<2:
+        return grade
+
+    lo,hi=window_bounds(distSum,window)
+    with np.errstate(divide='ignore',invalid='ignore'):   #   repeated points give inf/nan, as slope()
+        grade[1:]=(100*(alt[hi]-alt[lo])/((distSum[hi]-distSum[lo])*1600))[1:]
+
+    return grade
+
+def window_smooth(v,dist,window):
+    """Distance weighted mean of v over the segments within a distance window (km) centred on each point. O(1) per point from prefix sums, whatever the window.
+    Segments with nan are left out of the mean. First element is 0."""
+    out=np.zeros(len(v))
+    if len(v)<2:
+        return out
+
+    valid=np.isfinite(v)&np.isfinite(dist)
+    weight=cumulative(np.where(valid,dist,0))
+    total=cumulative(np.where(valid,v*dist,0))
+    lo,hi=window_bounds(cumulative(dist),window)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        out[1:]=np.where(weight[hi]>weight[lo],(total[hi]-total[lo])/(weight[hi]-weight[lo]),v)[1:]   #   zero length windows keep their own value
+
+    return out
+
+def speed(grade,posGrad,negGrad,neutral):
+    """Piecewise-linear walking speed from slope, floored at MIN_SPEED. First element is 0. UNITS: kph"""
+    v=np.where(grade>0,posGrad*grade+neutral,negGrad*grade+neutral)
+    v=np.where(v<MIN_SPEED,MIN_SPEED,v)
+    v[:1]=0
+
+    return v
+
+def speed_curve(grade,curve_grade,curve_speed):
+    """Walking speed interpolated from a calibrated speed against slope curve (held flat beyond its ends), floored at MIN_SPEED. First element is 0. UNITS: kph"""
+    v=np.interp(grade,curve_grade,curve_speed)
+    v=np.where(v<MIN_SPEED,MIN_SPEED,v)
+    v[:1]=0
+
+    return v
+
+def smooth(v,box_pts=BOX_PTS):
+    """Box filter over speed[1:], keeping the true end values. First element is 0."""
+    out=np.zeros(len(v))
+    if len(v)<2:
+        return out
+
+    box=np.ones(box_pts)/box_pts
+    out[1:]=np.convolve(v[1:],box,mode='same')[:len(v)-1]
+    out[1]=v[1]
+    out[-1]=v[-1]
+
+    return out
+
+def segment_time(dist,v):
+    """Time to walk each segment. First element is 0. UNITS: hrs"""
+    t=np.zeros(len(dist))
+    with np.errstate(divide='ignore',invalid='ignore'):
+        t[1:]=dist[1:]/v[1:]
+
+    return t
+
+def split_days(cost,days=None,target=None,day_cost=0):
+    """Splits a route into consecutive days of even cost. cost is per point (e.g. hrs walking to it incl. rest), day_cost is added once per day (e.g. lunch).
+    Give days: each day ends at the point closest to an equal share of the total, so no day is off by more than one point. Days are capped at the number of points, & every day gets at least one.
+    Or give target: the fewest days that keep every day within target (unless a single point costs more), each ending at the last point at or before its equal share where that allows.
+    Returns the day number (from 0) of every point."""
+    total=cumulative(np.nan_to_num(np.asarray(cost,dtype=float)))   #   repeated points have nan time
+    if len(total)==0:
+        return np.zeros(0,dtype=int)
+
+    if days==None:
+        if target==None or target<=day_cost:
+            raise ValueError(f"Target day ({target}) must be longer than the fixed rest per day ({day_cost})")
+        ends=target_ends(total,target-day_cost)
+    else:
+        if days<1:
+            raise ValueError(f"Can't split a route into {days} days")
+        days=min(days,len(total))
+        shares=total[-1]*np.arange(1,days)/days
+        ends=np.minimum(np.searchsorted(total,shares),len(total)-1)
+        before=np.maximum(ends-1,0)
+        ends=np.where(np.abs(total[before]-shares)<np.abs(total[ends]-shares),before,ends)
+        #   strictly increasing & leaving a point for each later day, so stretches of zero cost don't leave days empty
+        index=np.arange(days-1)
+        ends=np.minimum(np.maximum.accumulate(ends-index)+index,len(total)-days+index)
+
+    return np.searchsorted(ends,np.arange(len(total)),side='left')
+
+def target_ends(total,budget):
+    """Last point of every day but the final one, for the fewest days costing at most budget each. total is the running cost.
+    Each end is the last point at or before an equal share of the total, moved only as far as needed to stay within reach of the previous end & of the route's end."""
+    def reach(end):
+        """Furthest point a day starting after end can finish at, always at least one point on."""
+        start=total[end] if end>=0 else 0.0
+        return max(int(np.searchsorted(total,start+budget,side='right'))-1,end+1)
+
+    #   fewest days: each goes as far as it can
+    latest=[]
+    end=reach(-1)
+    while end<len(total)-1:
+        latest.append(end)
+        end=reach(end)
+    days=len(latest)+1
+
+    #   earliest each day can end with the remaining days still fitting, working back from the end
+    earliest=[]
+    end=len(total)-1
+    for _ in range(days-1):
+        end=min(int(np.searchsorted(total,total[end]-budget,side='left')),end-1)
+        earliest.append(end)
+    earliest.reverse()
+
+    shares=total[-1]*np.arange(1,days)/days
+    ends=np.searchsorted(total,shares,side='right')-1
+    end=-1
+    for day in range(days-1):
+        end=min(max(int(ends[day]),earliest[day],end+1),reach(end))
+        ends[day]=end
+
+    return ends
+
+class RouteIndex():
+    """Prefix sums of distance, time, ascent & descent along a route, so totals over any stretch are O(1).
+    Per-point values are those of the segment arriving at the point (first point 0), as in hikeData."""
+    COLUMNS=('dist','time','ascent','descent')
+
+    def __init__(self,dist,time,alt):
+        climb=np.zeros(len(alt))
+        climb[1:]=np.diff(np.asarray(alt,dtype=float))
+        values={
+            'dist':np.asarray(dist,dtype=float),
+            'time':np.asarray(time,dtype=float),
+            'ascent':np.maximum(climb,0),
+            'descent':np.maximum(-climb,0),
+        }
+
+        #   prefix[k] = sum of the first k values, so values start..stop-1 sum to prefix[stop]-prefix[start]
+        self.prefix={}
+        for column,value in values.items():
+            prefix=np.zeros(len(value)+1)
+            prefix[1:]=cumulative(np.nan_to_num(value)) #   repeated points have nan time
+            self.prefix[column]=prefix
+
+    def __len__(self):
+        return len(self.prefix['dist'])-1
+
+    def between(self,start,end):
+        """Totals walking from point start to point end. Takes scalars or arrays (many ranges at once); end<start gives negative totals."""
+        start=np.asarray(start)+1
+        end=np.asarray(end)+1
+
+        return {column:prefix[end]-prefix[start] for column,prefix in self.prefix.items()}
+
+    def sums(self,start,stop):
+        """Totals of the per-point values of points start..stop-1 (slice semantics). Takes scalars or arrays."""
+        return {column:prefix[stop]-prefix[start] for column,prefix in self.prefix.items()}
+
+    def locate(self,dist):
+        """First point at or beyond a distance (km) from the start. Takes scalars or arrays."""
+        return np.minimum(np.searchsorted(self.prefix['dist'][1:],dist),len(self)-1)
+
+    def labelled(self,labels):
+        """Totals per label (e.g. day) of every point carrying it, nan = unlabelled. Labels needn't be contiguous: each run of equal labels is one O(1) query.
+        Returns (sorted labels, dict of totals per label)."""
+        labels=np.asarray(labels,dtype=float)
+        if len(labels)==0:
+            return labels,{column:np.zeros(0) for column in self.prefix}
+
+        missing=np.isnan(labels)
+        change=(labels[1:]!=labels[:-1])&~(missing[1:]&missing[:-1])
+        starts=np.concatenate(([0],np.flatnonzero(change)+1))
+        stops=np.concatenate((starts[1:],[len(labels)]))
+        run_labels=labels[starts]
+        valid=~np.isnan(run_labels)
+        starts,stops,run_labels=starts[valid],stops[valid],run_labels[valid]
+
+        unique,inverse=np.unique(run_labels,return_inverse=True)
+        totals=self.sums(starts,stops)
+
+        return unique,{column:np.bincount(inverse,weights=total,minlength=len(unique)) for column,total in totals.items()}
+
+def decimate(x,y,width,lo=None,hi=None):
+    """Indices of the points needed to draw y against increasing x at width pixels between lo & hi: the first, last, min & max of each pixel column (nan ignored),
+    plus the nearest point beyond each end so the line reaches the edges. Drawing cost depends on width, not on the number of points."""
+    start=0 if lo==None else max(int(np.searchsorted(x,lo,side='left'))-1,0)
+    end=len(x) if hi==None else min(int(np.searchsorted(x,hi,side='right'))+1,len(x))
+    if end-start<=4*width:
+        return np.arange(start,end)
+
+    xs=x[start:end]
+    ys=np.asarray(y[start:end],dtype=float)
+    starts=np.unique(np.searchsorted(xs,np.linspace(xs[0],xs[-1],width+1)[:-1],side='left'))    #   empty columns collapse
+    counts=np.diff(np.append(starts,len(xs)))
+    column=np.repeat(np.arange(len(starts)),counts)
+
+    keep=[starts,starts+counts-1]
+    for fill,reduce in ((np.inf,np.minimum),(-np.inf,np.maximum)):
+        filled=np.where(np.isnan(ys),fill,ys)
+        extreme=np.flatnonzero(filled==np.repeat(reduce.reduceat(filled,starts),counts))
+        keep.append(extreme[np.unique(column[extreme],return_index=True)[1]])   #   first extreme of each column
+
+    return np.unique(np.concatenate(keep))+start
+
+def douglas_peucker(x,y,tolerance):
+    """Mask of points kept by Douglas-Peucker: every dropped point is within tolerance of the simplified line. End points are always kept."""
+    keep=np.zeros(len(x),dtype=bool)
+    if len(x)==0:
+        return keep
+    keep[0]=keep[-1]=True
+
+    stack=[(0,len(x)-1)]
+    while len(stack)!=0:
+        start,end=stack.pop()
+        if end-start<2:
+            continue
+
+        #   distance of every point in the range from the chord start-end
+        dx,dy=x[end]-x[start],y[end]-y[start]
+        px,py=x[start+1:end]-x[start],y[start+1:end]-y[start]
+        length2=dx*dx+dy*dy
+        if length2==0:
+            dist2=px*px+py*py
+        else:
+            t=np.clip((px*dx+py*dy)/length2,0,1)
+            dist2=(px-t*dx)**2+(py-t*dy)**2
+
+        i=int(np.argmax(dist2))
+        if dist2[i]>tolerance*tolerance:
+            split=start+1+i
+            keep[split]=True
+            stack.append((start,split))
+            stack.append((split,end))
+
+    return keep
+
+def simplify(lat,lon,tolerance,segment=None,max_error=MAX_SIMPLIFY_ERROR,noise=SIMPLIFY_NOISE):
+    """Mask of points to keep so the track stays within tolerance (m) of the original. Segment ends are kept.
+    Tolerances from noise up to the requested one, on a fixed geometric grid (so a larger tolerance never keeps more points), are tried & the one keeping the fewest points with total distance within max_error of the reference is used.
+    The reference is the track simplified to noise (or to tolerance, if smaller), since gps jitter inflates the raw distance & would fail every tolerance.
+    Only distance is checked: simplifying runs before altitudes are known, so time & ascent totals (which depend on slope) aren't bounded.
+    Returns (keep, error): error is the relative change in total distance from the reference."""
+    lat=np.asarray(lat,dtype=float)
+    lon=np.asarray(lon,dtype=float)
+    if segment is None:
+        segment=np.zeros(len(lat),dtype=int)
+    if len(lat)<3:
+        return np.ones(len(lat),dtype=bool),0.0
+
+    #   local equirectangular projection, metres
+    lat_rad,lon_rad=np.radians(lat),np.radians(lon)
+    y=lat_rad*EARTH_RADIUS*1000
+    x=lon_rad*EARTH_RADIUS*1000*np.cos(np.mean(lat_rad))
+
+    bounds=np.flatnonzero(np.diff(segment)!=0)+1
+    starts=np.concatenate(([0],bounds))
+    ends=np.concatenate((bounds,[len(lat)]))
+    def peucker(tolerance):
+        keep=np.zeros(len(lat),dtype=bool)
+        for start,end in zip(starts,ends):
+            keep[start:end]=douglas_peucker(x[start:end],y[start:end],tolerance)
+        return keep,np.sum(haversine(lat_rad[keep],lon_rad[keep]))
+
+    reference,total=peucker(min(noise,tolerance))
+    best,error=reference,0.0
+    steps=int(np.floor(SIMPLIFY_STEPS*np.log2(tolerance/noise)+1e-9)) if tolerance>noise else 0
+    for step in range(1,steps+1):
+        keep,simplified=peucker(noise*2**(step/SIMPLIFY_STEPS))
+        change=abs(total-simplified)/total if total!=0 else 0.0
+        if change<=max_error and np.count_nonzero(keep)<np.count_nonzero(best):
+            best,error=keep,change
+
+    return best,error
+
+def corridor_tiles(x,y,tile_size,buffer,segment=None):
+    """Tiles within buffer of the route line, in map pixel coordinates (as Path.coord_to_pixels). Returns unique (column,row) pairs, shape (n,2).
+    The line is simplified & resampled at half a tile first, so the cost depends on the route's length in tiles, not its number of points.
+    Distance is measured per axis, so the corridor is slightly wider than buffer at diagonals."""
+    x=np.asarray(x,dtype=float)
+    y=np.asarray(y,dtype=float)
+    if segment is None:
+        segment=np.zeros(len(x),dtype=int)
+    if len(x)==0:
+        return np.zeros((0,2),dtype=int)
+
+    tolerance=tile_size/8
+    step=tile_size/2
+    buffer=buffer+tolerance+step/2   #   every point of the route is within this of a sample
+
+    bounds=np.concatenate(([0],np.flatnonzero(np.diff(segment)!=0)+1,[len(x)]))
+    samples_x,samples_y=[],[]
+    for start,end in zip(bounds[:-1],bounds[1:]):
+        keep=douglas_peucker(x[start:end],y[start:end],tolerance)
+        px,py=x[start:end][keep],y[start:end][keep]
+
+        #   evenly spaced samples along every edge, plus the last point
+        reps=np.maximum(np.ceil(np.hypot(np.diff(px),np.diff(py))/step),1).astype(int)
+        edge=np.repeat(np.arange(len(reps)),reps)
+        t=(np.arange(len(edge))-np.repeat(np.cumsum(reps)-reps,reps))/reps[edge] if len(edge)!=0 else np.zeros(0)
+        samples_x.append(np.concatenate((px[edge]+t*(px[edge+1]-px[edge]),px[-1:])))
+        samples_y.append(np.concatenate((py[edge]+t*(py[edge+1]-py[edge]),py[-1:])))
+    sx=np.concatenate(samples_x)
+    sy=np.concatenate(samples_y)
+
+    #   every tile overlapping the square of side 2*buffer around each sample
+    reach=int(np.ceil(buffer/tile_size))
+    col=np.floor(sx/tile_size).astype(int)
+    row=np.floor(sy/tile_size).astype(int)
+    found=[]
+    for dx in range(-reach,reach+1):
+        near_x=((col+dx)*tile_size<=sx+buffer)&((col+dx+1)*tile_size>=sx-buffer)
+        for dy in range(-reach,reach+1):
+            near=near_x&((row+dy)*tile_size<=sy+buffer)&((row+dy+1)*tile_size>=sy-buffer)
+            found.append(np.column_stack((col[near]+dx,row[near]+dy)))
+
+    return np.unique(np.concatenate(found),axis=0)
@@ -0,0 +1,78 @@
+import os.path
+import hashlib
+import json
+import struct
+import numpy as np
+
+MAGIC=b'HIKESNAP'
+VERSION=1
+ALIGN=64    #   column blocks start on 64 byte boundaries so they can be viewed in place
+EXTENSION='.hike'
+
+#   file layout: MAGIC | version (uint32) | header length (uint32) | json header | padding | column blocks
+
+def checksum(file):
+    """sha256 of a file's contents."""
+    digest=hashlib.sha256()
+    with open(file,'rb') as f:
+        for block in iter(lambda: f.read(2**20),b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def defaultFile(gps_file,cache_dir):
+    """Snapshot location for a gps file, keyed by its absolute path."""
+    key=hashlib.sha256(os.path.abspath(gps_file).encode()).hexdigest()[:16]
+
+    return os.path.join(cache_dir,'snapshots',key+EXTENSION)
+
+def save(file,columns,meta):
+    """Writes numeric columns (dict of 1D arrays of equal length) & json-able meta. Written to a temp file first so a crash never leaves half a snapshot.
+    Nothing may still view a loaded copy of file when it is replaced: Windows can't replace a file that is memory mapped."""
+    if os.path.dirname(file)!='':
+        os.makedirs(os.path.dirname(file),exist_ok=True)
+
+    layout=[]
+    offset=0
+    arrays=[]
+    for name,values in columns.items():
+        values=np.ascontiguousarray(values)
+        if values.dtype==object:
+            raise TypeError(f"Column '{name}' has object dtype and can't be stored in a snapshot")
+        offset=-(-offset//ALIGN)*ALIGN
+        layout.append({'name':name,'dtype':values.dtype.str,'offset':offset,'length':len(values)})
+        arrays.append((offset,values))
+        offset+=values.nbytes
+
+    header=json.dumps({'meta':meta,'columns':layout}).encode()
+    start=-(-(len(MAGIC)+8+len(header))//ALIGN)*ALIGN   #   column offsets are relative to here
+
+    tmp=f'{file}.{os.getpid()}.tmp'    #   per process, so workers saving the same route don't write into each other's file
+    with open(tmp,'wb') as f:
+        f.write(MAGIC+struct.pack('<II',VERSION,len(header))+header)
+        for column_offset,values in arrays:
+            f.seek(start+column_offset)
+            f.write(values.tobytes())
+        f.truncate(start+offset)
+    os.replace(tmp,file)
+
+def load(file):
+    """Memory maps a snapshot. Returns (columns dict of read-only views into the file, meta). Raises ValueError if it isn't a snapshot."""
+    with open(file,'rb') as f:
+        prefix=f.read(len(MAGIC)+8)
+        if len(prefix)<len(MAGIC)+8 or prefix[:len(MAGIC)]!=MAGIC:
+            raise ValueError(f"{file} is not a route snapshot")
+        version,header_length=struct.unpack('<II',prefix[len(MAGIC):])
+        if version!=VERSION:
+            raise ValueError(f"{file} is snapshot version {version}, expected {VERSION}")
+        header=json.loads(f.read(header_length))
+
+    start=-(-(len(MAGIC)+8+header_length)//ALIGN)*ALIGN
+    columns={}
+    buffer=np.memmap(file,dtype=np.uint8,mode='r') if os.path.getsize(file)>start else np.empty(0,dtype=np.uint8)
+    for column in header['columns']:
+        dtype=np.dtype(column['dtype'])
+        begin=start+column['offset']
+        columns[column['name']]=buffer[begin:begin+column['length']*dtype.itemsize].view(dtype)
+
+    return columns,header['meta']
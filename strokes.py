@@ -0,0 +1,106 @@
+import numpy as np
+
+class StrokeStore():
+    """Painted strokes kept as growable arrays: every point's position, and each stroke's id, day & brush radius.
+    Positions & radii are map coordinates at zoom 0 (see Path.coord_to_pixels), so a painting survives zooming & can be saved with the route.
+    Ids are never reused, so canvas items tagged with one stay valid as strokes are undone or dropped."""
+    CAPACITY=1024   #   initial points, doubled whenever full
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.xy=np.empty((self.CAPACITY,2))
+        self.points=0
+        self.start=[]   #   first point of each stroke
+        self.ids=[]
+        self.days=[]
+        self.radii=[]
+        self.nextId=0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def begin(self,day,radius):
+        """Starts a stroke; points are added to it until the next begin. Returns its id."""
+        self.start.append(self.points)
+        self.ids.append(self.nextId)
+        self.days.append(day)
+        self.radii.append(radius)
+        self.nextId+=1
+
+        return self.ids[-1]
+
+    def add(self,x,y):
+        """Appends a point to the current stroke. Amortised O(1)."""
+        if self.points==len(self.xy):
+            xy=np.empty((2*len(self.xy),2))
+            xy[:self.points]=self.xy[:self.points]
+            self.xy=xy
+        self.xy[self.points]=(x,y)
+        self.points+=1
+
+    def bounds(self):
+        """Start & end (exclusive) point of every stroke."""
+        start=np.array(self.start,dtype=int)
+
+        return start,np.append(start[1:],self.points).astype(int)
+
+    def stroke(self,i):
+        """(id, day, radius, points) of the i-th stroke."""
+        start,end=self.bounds()
+
+        return self.ids[i],self.days[i],self.radii[i],self.xy[start[i]:end[i]]
+
+    def pointData(self):
+        """Position, day & radius of every painted point. Returns (xy, day, radius) arrays."""
+        start,end=self.bounds()
+        lengths=end-start
+
+        return self.xy[:self.points],np.repeat(np.array(self.days,dtype=int),lengths),np.repeat(np.array(self.radii,dtype=float),lengths)
+
+    def undo(self):
+        """Removes the last stroke. Returns its id, or None if nothing is painted."""
+        if len(self.ids)==0:
+            return None
+
+        self.points=self.start.pop()
+        self.days.pop()
+        self.radii.pop()
+
+        return self.ids.pop()
+
+    def dropDays(self,days):
+        """Removes strokes painted for day numbers days & above. Returns the ids removed."""
+        keep=np.array(self.days,dtype=int)<days
+        if keep.all():
+            return []
+
+        start,end=self.bounds()
+        removed=[id for id,kept in zip(self.ids,keep) if not kept]
+        points=np.repeat(keep,end-start)
+        lengths=(end-start)[keep]
+        self.xy[:np.count_nonzero(points)]=self.xy[:self.points][points]
+        self.points=int(np.count_nonzero(points))
+        self.start=(np.cumsum(lengths)-lengths).tolist()
+        self.ids=[id for id,kept in zip(self.ids,keep) if kept]
+        self.days=[day for day,kept in zip(self.days,keep) if kept]
+        self.radii=[radius for radius,kept in zip(self.radii,keep) if kept]
+
+        return removed
+
+    def toDict(self):
+        """Json-able painting, e.g. for snapshot settings."""
+        return {'xy':self.xy[:self.points].ravel().tolist(),'start':self.start,'day':self.days,'radius':self.radii}
+
+    @classmethod
+    def fromDict(cls,data):
+        store=cls()
+        xy=np.array(data['xy'],dtype=float).reshape(-1,2)
+        for i,(day,radius) in enumerate(zip(data['day'],data['radius'])):
+            store.begin(day,radius)
+            end=data['start'][i+1] if i+1<len(data['start']) else len(xy)
+            for x,y in xy[data['start'][i]:end]:
+                store.add(x,y)
+
+        return store
@@ -0,0 +1,49 @@
+import os
+import zipfile
+import numpy as np
+
+CENTRE=(54.45,-3.1) #   lat/lon of the synthetic routes
+EXTENT=0.1  #   degrees, routes stay inside this box whatever their size, so the map is the same for every size
+
+def syntheticRoute(n,seed=0):
+    """Deterministic lissajous walk of n points with gps-like jitter. Returns lat & lon arrays."""
+    rng=np.random.default_rng(seed)
+    t=np.linspace(0,2*np.pi,n)
+    lat=CENTRE[0]+EXTENT/2*np.sin(3*t)+rng.normal(0,2e-5,n)
+    lon=CENTRE[1]+EXTENT/2*np.sin(4*t+np.pi/4)+rng.normal(0,2e-5,n)
+
+    return lat,lon
+
+def syntheticAltitude(lat,lon):
+    """Smooth deterministic terrain, m."""
+    return 300+250*np.sin(lat*60)*np.cos(lon*40)
+
+def writeGpx(file,lat,lon):
+    with open(file,'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="benchmark" xmlns="http://www.topografix.com/GPX/1/1">\n<trk><name>benchmark</name><trkseg>\n')
+        for start in range(0,len(lat),100000):
+            f.write(''.join(f'<trkpt lat="{a:.7f}" lon="{b:.7f}"></trkpt>\n' for a,b in zip(lat[start:start+100000],lon[start:start+100000])))
+        f.write('</trkseg></trk>\n</gpx>\n')
+
+def kmlText(lat,lon):
+    coordinates=' '.join(f'{b:.7f},{a:.7f},0' for a,b in zip(lat,lon))
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2"><Document><name>benchmark</name>'
+            f'<Placemark><name>benchmark</name><LineString><coordinates>{coordinates}</coordinates></LineString></Placemark></Document></kml>\n')
+
+def writeKml(file,lat,lon):
+    with open(file,'w') as f:
+        f.write(kmlText(lat,lon))
+
+def writeKmz(file,lat,lon):
+    with zipfile.ZipFile(file,'w',zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('doc.kml',kmlText(lat,lon))
+
+def writeRoute(directory,n,fmt):
+    """Writes a synthetic route of n points as gpx, kml or kmz. Returns the file name."""
+    file=os.path.join(directory,f'route_{n}.{fmt}')
+    if not os.path.isfile(file):
+        lat,lon=syntheticRoute(n)
+        {'gpx':writeGpx,'kml':writeKml,'kmz':writeKmz}[fmt](file,lat,lon)
+
+    return file
@@ -0,0 +1,38 @@
+import os
+import numpy as np
+
+import elevation
+import hike_data_processor
+import synthetic
+
+SPEED_FILE=os.path.join(os.path.dirname(os.path.abspath(__file__)),'hike.json')
+
+class TerrainProvider(elevation.ElevationProvider):
+    """Altitude of the synthetic terrain at every requested point."""
+    def __init__(self,cached):
+        super().__init__()
+        self.cached=cached
+
+    def fetch(self,coords,callback=None):
+        alts=synthetic.syntheticAltitude(coords[:,0],coords[:,1])
+        if callback!=None:
+            callback(0,alts)
+        return alts
+
+def altitudes(gps_file,provider,cache=None):
+    path=hike_data_processor.Path(gps_file,SPEED_FILE,elevation_cache=cache,elevation_provider=provider)
+    path.getElevations()
+    return path.hikeData['alt'].to_numpy()
+
+def test_cached_altitudes_match_uncached_per_point(tmp_path):
+    gps_file=str(tmp_path/'dense.gpx')
+    synthetic.writeGpx(gps_file,*synthetic.syntheticRoute(20000))  #   a few metres between points, several per 25 m DEM cell
+    cache=elevation.ElevationCache(str(tmp_path/'elevation.sqlite'))
+
+    expected=altitudes(gps_file,TerrainProvider(cached=False))
+    cold=altitudes(gps_file,TerrainProvider(cached=True),cache)
+    warm=altitudes(gps_file,TerrainProvider(cached=True),cache)
+
+    #   points within ~1 m of each other share an altitude, off by at most the terrain's rise over that metre
+    assert np.allclose(cold,expected,atol=0.25)
+    assert np.allclose(warm,expected,atol=0.25)
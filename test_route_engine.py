@@ -0,0 +1,113 @@
+import numpy as np
+
+import route_engine
+
+def day_costs(cost,day,day_cost):
+    return np.bincount(day,weights=np.nan_to_num(cost))+day_cost
+
+def test_split_days_target_keeps_every_day_within_target():
+    rng=np.random.default_rng(0)
+    for _ in range(500):
+        cost=rng.exponential(rng.choice([0.01,0.1,1]),rng.integers(1,500))
+        cost[0]=0
+        cost[rng.integers(0,len(cost),3)]=np.nan    #   repeated points
+        day_cost=rng.uniform(0,0.5)
+        target=rng.uniform(max(np.nan_to_num(cost).max(),0.1)+day_cost,20)
+
+        day=route_engine.split_days(cost,target=target,day_cost=day_cost)
+
+        assert np.all(np.diff(day)>=0) and np.all(np.diff(day)<=1) and day[0]==0
+        assert np.all(day_costs(cost,day,day_cost)<=target+1e-9)
+
+def test_split_days_target_uses_the_fewest_days():
+    day=route_engine.split_days(np.ones(10),target=3)
+
+    assert day.max()+1==4
+    assert np.all(day_costs(np.ones(10),day,0)<=3)
+
+def test_split_days_even_shares():
+    day=route_engine.split_days(np.ones(9),days=3)
+
+    assert np.array_equal(np.bincount(day),[3,3,3])
+
+def test_split_days_more_days_than_points():
+    assert np.array_equal(route_engine.split_days(np.ones(3),days=5),[0,1,2])
+    assert np.array_equal(route_engine.split_days([0,0,0,10],days=3),[0,0,1,2])    #   no empty days where the cost is zero
+
+def route(n,seed=0):
+    """Random walk of n points (radians, m) with a few repeated points."""
+    rng=np.random.default_rng(seed)
+    lat=np.radians(51+np.cumsum(rng.normal(0,1e-4,n)))
+    lon=np.radians(-3+np.cumsum(rng.normal(0,1e-4,n)))
+    alt=300+np.cumsum(rng.normal(0,2,n))
+    repeat=rng.integers(1,n,5)
+    lat[repeat],lon[repeat],alt[repeat]=lat[repeat-1],lon[repeat-1],alt[repeat-1]
+    return lat,lon,alt
+
+def test_pipeline_matches_the_original_loops():
+    lat,lon,alt=route(2000)
+    pos,neg,neutral=-0.2,0.1,5
+
+    #   per-row loops of the original Path.calcDist, calcSlope, calcSpeed & calcTime
+    dist,distSum,grade,v,t=[0],[0],[0],[0],[0]
+    for i in range(1,len(lat)):
+        d=2*6371*np.arcsin(np.sqrt((np.sin((lat[i]-lat[i-1])/2)**2+np.cos(lat[i-1])*np.cos(lat[i])*np.sin((lon[i]-lon[i-1])/2)**2)))
+        dist.append(float(d))
+        distSum.append(distSum[i-1]+float(d))
+        with np.errstate(divide='ignore',invalid='ignore'):
+            grade.append(float(100*(alt[i]-alt[i-1])/(np.float64(d)*1600)))
+        speed=pos*grade[i]+neutral if grade[i]>0 else neg*grade[i]+neutral
+        if speed<0.3:
+            speed=0.3
+        v.append(float(speed))
+        with np.errstate(divide='ignore',invalid='ignore'):
+            t.append(float(np.float64(d)/v[i]))
+    smoothed=list(np.convolve(v[1:],np.ones(8)/8,mode='same'))
+    smoothed[0],smoothed[-1]=v[1],v[-1]
+
+    d=route_engine.haversine(lat,lon)
+    g=route_engine.slope(alt,d)
+    s=route_engine.speed(g,pos,neg,neutral)
+    assert np.allclose(d,dist,rtol=1e-12,atol=0)
+    assert np.allclose(route_engine.cumulative(d),distSum,rtol=1e-12,atol=0)
+    assert np.allclose(g,grade,rtol=1e-12,atol=0,equal_nan=True)
+    assert np.allclose(s,v,rtol=1e-12,atol=0,equal_nan=True)
+    assert np.allclose(route_engine.smooth(s),[0]+smoothed,rtol=1e-12,atol=0,equal_nan=True)
+    assert np.allclose(route_engine.segment_time(d,s),t,rtol=1e-12,atol=0,equal_nan=True)
+
+def test_window_smoothing_matches_brute_force():
+    lat,lon,alt=route(500,1)
+    dist=route_engine.haversine(lat,lon)
+    distSum=route_engine.cumulative(dist)
+    v=route_engine.speed(route_engine.slope(alt,dist),-0.2,0.1,5)
+    window=0.1
+
+    slope,smoothed=[0],[0]
+    for i in range(1,len(v)):
+        #   window: every point within window/2 either side, widened to at least the segment arriving at i
+        inside=[j for j in range(len(v)) if abs(distSum[j]-distSum[i])<=window/2]
+        lo,hi=min(inside[0],i-1),max(inside[-1],i)
+        slope.append(100*(alt[hi]-alt[lo])/((distSum[hi]-distSum[lo])*1600) if distSum[hi]>distSum[lo] else np.nan)
+        segments=[j for j in range(lo+1,hi+1) if np.isfinite(v[j])]
+        weight=sum(dist[j] for j in segments)
+        smoothed.append(sum(v[j]*dist[j] for j in segments)/weight if weight>0 else v[i])
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        assert np.allclose(route_engine.window_slope(alt,distSum,window),slope,equal_nan=True)
+    assert np.allclose(route_engine.window_smooth(v,dist,window),smoothed,equal_nan=True)
+
+def test_route_index_matches_direct_sums():
+    lat,lon,alt=route(300,2)
+    dist=route_engine.haversine(lat,lon)
+    time=route_engine.segment_time(dist,route_engine.speed(route_engine.slope(alt,dist),-0.2,0.1,5))
+    index=route_engine.RouteIndex(dist,time,alt)
+
+    rng=np.random.default_rng(3)
+    start,end=np.sort(rng.integers(0,len(dist),(2,200)),axis=0)
+    totals=index.between(start,end)
+    for k in range(len(start)):
+        climb=np.diff(alt[start[k]:end[k]+1])
+        assert np.isclose(totals['dist'][k],dist[start[k]+1:end[k]+1].sum())
+        assert np.isclose(totals['time'][k],np.nansum(time[start[k]+1:end[k]+1]))
+        assert np.isclose(totals['ascent'][k],climb[climb>0].sum())
+        assert np.isclose(totals['descent'][k],-climb[climb<0].sum())
@@ -0,0 +1,248 @@
+import os.path
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+import requests
+
+from elevation import DEFAULT_CACHE_DIR
+import downloads
+import instrument
+
+class TileCache():
+    """Two level store of map tiles keyed by server/z/x/y: decoded tiles in an in-memory LRU, png bytes in sqlite on disk."""
+    DEFAULT_MAX_TILES=512   #   in memory, ~100 MB of decoded 256x256 RGB tiles
+    DEFAULT_MAX_BYTES=500*2**20 #   on disk
+
+    def __init__(self,file=None,max_tiles=None,max_bytes=None):
+        if file==None:
+            file=os.path.join(DEFAULT_CACHE_DIR,'tiles.sqlite')
+        if os.path.dirname(file)!='':
+            os.makedirs(os.path.dirname(file),exist_ok=True)
+        self.file=file
+        self.max_tiles=self.DEFAULT_MAX_TILES if max_tiles==None else max_tiles
+        self.max_bytes=self.DEFAULT_MAX_BYTES if max_bytes==None else max_bytes
+        self.stats={'memory_hits':0,'disk_hits':0,'misses':0}
+
+        self.memory=OrderedDict()   #   least recently used first
+        self.lock=threading.Lock()
+        self.db=sqlite3.connect(file,timeout=30,check_same_thread=False)
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS tile (server TEXT, z INTEGER, x INTEGER, y INTEGER, data BLOB, size INTEGER, used REAL, PRIMARY KEY (server,z,x,y))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS tile_used ON tile (used)")
+            #   tile count & bytes, updated by put() & evict() in the same transaction as the tiles, so every process sharing the cache enforces the real total without summing
+            self.db.execute("CREATE TABLE IF NOT EXISTS tile_totals (id INTEGER PRIMARY KEY, tiles INTEGER, bytes INTEGER)")
+            self.db.execute("INSERT OR IGNORE INTO tile_totals SELECT 0,COUNT(*),COALESCE(SUM(size),0) FROM tile")
+
+    def get(self,server,z,x,y):
+        """Returns the decoded tile, or None if it is not cached."""
+        key=(server,z,x,y)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits']+=1
+                instrument.count('tile_cache.memory_hits')
+                return self.memory[key]
+
+            with self.db:
+                row=self.db.execute("SELECT data FROM tile WHERE server=? AND z=? AND x=? AND y=?",(server,z,x,y)).fetchone()
+                if row!=None:
+                    self.db.execute("UPDATE tile SET used=? WHERE server=? AND z=? AND x=? AND y=?",(time.time(),server,z,x,y))
+            if row==None:
+                self.stats['misses']+=1
+                instrument.count('tile_cache.misses')
+                return None
+            self.stats['disk_hits']+=1
+            instrument.count('tile_cache.disk_hits')
+
+        img=self.decode(row[0])
+        with self.lock:
+            self.remember(key,img)
+
+        return img
+
+    def put(self,server,z,x,y,data):
+        """Stores raw tile bytes on disk & evicts least recently used tiles over the size limit. Returns the decoded tile."""
+        img=self.decode(data)
+        with self.lock:
+            with self.db:
+                self.db.execute("BEGIN IMMEDIATE")  #   takes the write lock first, so no other process changes the tile between reading its old size & replacing it
+                old=self.db.execute("SELECT size FROM tile WHERE server=? AND z=? AND x=? AND y=?",(server,z,x,y)).fetchone()
+                self.db.execute("INSERT OR REPLACE INTO tile VALUES (?,?,?,?,?,?,?)",(server,z,x,y,sqlite3.Binary(data),len(data),time.time()))
+                if old==None:
+                    self.db.execute("UPDATE tile_totals SET tiles=tiles+1,bytes=bytes+? WHERE id=0",(len(data),))
+                else:
+                    self.db.execute("UPDATE tile_totals SET bytes=bytes+? WHERE id=0",(len(data)-old[0],))
+                self.evict()
+            self.remember((server,z,x,y),img)
+
+        return img
+
+    @instrument.timed('tiles.decode')
+    def decode(self,data):
+        img=Image.open(BytesIO(data))
+        img.load()  #   decodes now rather than on first paste
+
+        return img
+
+    def remember(self,key,img):
+        """Adds a decoded tile to the in-memory LRU. Caller holds the lock."""
+        self.memory[key]=img
+        self.memory.move_to_end(key)
+        while len(self.memory)>self.max_tiles:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        """Deletes least recently used tiles until the disk store fits max_bytes. Caller holds the lock & a transaction."""
+        while True:
+            tiles,total=self.db.execute("SELECT tiles,bytes FROM tile_totals WHERE id=0").fetchone()
+            if total<=self.max_bytes or tiles<=0:
+                break
+            #   enough of the oldest tiles to cover the excess if they are of average size, repeated if they fall short
+            limit=-(-(total-self.max_bytes)*tiles//total)
+            stale="SELECT rowid FROM tile ORDER BY used LIMIT ?"
+            count,size=self.db.execute(f"SELECT COUNT(*),COALESCE(SUM(size),0) FROM tile WHERE rowid IN ({stale})",(limit,)).fetchone()
+            if count==0:
+                break
+            self.db.execute(f"DELETE FROM tile WHERE rowid IN ({stale})",(limit,))
+            self.db.execute("UPDATE tile_totals SET tiles=tiles-?,bytes=bytes-? WHERE id=0",(count,size))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM tile").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+class TileFetcher(downloads.HttpFetcher):
+    """Downloads slippy map tiles over a pooled session with a bounded number of requests in flight. Tiles that keep failing are tried on the fallback servers."""
+    WORKERS=8   #   spread over the fallback servers too, each capped at HOST_CONNECTIONS
+    HOST_CONNECTIONS=2  #   per tile server, shared by every fetch in the process (pyramid levels & the background fill), as the osm tile usage policy asks
+    RETRIES=2
+    TIMEOUT=10  #   seconds
+    BACKOFF=0.5 #   seconds, doubled every retry
+    COUNTER='tiles'
+
+    def __init__(self,workers=WORKERS,retries=RETRIES,timeout=TIMEOUT,backoff=BACKOFF,host_connections=HOST_CONNECTIONS):
+        super().__init__(workers,retries,timeout,backoff,host_connections)
+        self.stats={'requests':0,'retries':0,'fallbacks':0,'failed':0,'seconds':0.0}
+
+    def request(self,host,z,x,y):
+        """Gets one tile. Returns png bytes."""
+        return self.get("{host}/{z}/{x}/{y}.png".format(host=host,z=z,x=x,y=y)).content
+
+    def download(self,servers,z,x,y):
+        """Tries each server in turn. Returns (host,png bytes), or (None,error) if every server failed."""
+        error=None
+        for i,host in enumerate(servers):
+            if i>0:
+                with self.stats_lock:
+                    self.stats['fallbacks']+=1
+                instrument.count('tiles.fallbacks')
+            try:
+                return host,self.request(host,z,x,y)
+            except requests.RequestException as e:
+                error=e
+
+        return None,error
+
+    def fetch(self,servers,z,tasks,callback):
+        """Gets [x,y] tiles from servers[0], falling back to the rest in order. callback(x,y,host,data) is called on this thread as each tile lands; host is None & data the error for tiles that could not be downloaded."""
+        def landed(task,result):
+            x,y=task
+            host,data=result
+            if host==None:
+                with self.stats_lock:
+                    self.stats['failed']+=1
+                instrument.count('tiles.failed')
+            callback(x,y,host,data)
+
+        t0=time.perf_counter()
+        self.pipeline(lambda x,y: self.download(servers,z,x,y),tasks,landed)
+
+        with self.stats_lock:
+            self.stats['seconds']+=time.perf_counter()-t0
+
+class MapPyramid():
+    """Prepared map mosaics per (server,zoom). Missing levels are built on a small background pool, so get() never waits on the network."""
+    WORKERS=2
+
+    def __init__(self,build,workers=WORKERS):
+        self.build=build    #   build(server,zoom) -> prepared mosaic
+        self.levels={}
+        self.pending=set()
+        self.errors={}
+        self.lock=threading.Lock()
+        self.pool=ThreadPoolExecutor(max_workers=workers)
+
+    def get(self,server,zoom):
+        """Prepared mosaic, or None if it isn't ready yet."""
+        with self.lock:
+            return self.levels.get((server,zoom))
+
+    def error(self,server,zoom):
+        """Exception raised building a level in the background, if any."""
+        with self.lock:
+            return self.errors.get((server,zoom))
+
+    def request(self,server,zoom):
+        """Starts building a level in the background unless it is held or already on its way."""
+        key=(server,zoom)
+        with self.lock:
+            if key in self.levels or key in self.pending:
+                return
+            self.pending.add(key)
+            self.errors.pop(key,None)
+        self.pool.submit(self.buildBackground,key)
+
+    def buildBackground(self,key):
+        try:
+            prepared=self.build(*key)
+        except Exception as error:  #   reported through error(), the pool would swallow it
+            with self.lock:
+                self.errors[key]=error
+                self.pending.discard(key)
+            return
+
+        with self.lock:
+            self.levels[key]=prepared
+            self.pending.discard(key)
+
+    def prefetch(self,server,zoom,zooms):
+        """Requests the levels either side of zoom, if they are in zooms."""
+        for z in (zoom+1,zoom-1):
+            if z in zooms:
+                self.request(server,z)
+
+    def nearest(self,server,zoom):
+        """Held level closest to zoom, preferring the same server. Returns (server,zoom,prepared) or None."""
+        with self.lock:
+            if len(self.levels)==0:
+                return None
+            key=min(self.levels,key=lambda k: (k[0]!=server,abs(k[1]-zoom)))
+
+            return key+(self.levels[key],)
+
+    def close(self):
+        self.pool.shutdown(wait=False,cancel_futures=True)
+
+_shared=None
+_shared_lock=threading.Lock()
+
+def shared_cache():
+    """TileCache used by every Path that isn't given its own."""
+    global _shared
+    with _shared_lock:
+        if _shared==None:
+            _shared=TileCache()
+
+        return _shared
+
+def set_shared_cache(cache):
+    global _shared
+    with _shared_lock:
+        _shared=cache